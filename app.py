@@ -1,17 +1,13 @@
+import importlib
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import numpy as np
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-# Importar módulos
-from modules.averias import create_averias_dashboard
-from modules.desempeño import create_performance_dashboard
-from modules.configuration import create_configuration_dashboard
-from modules.provision import create_provision_dashboard
-from modules.disponibilidad import create_availability_dashboard
-from modules.calidad import create_quality_dashboard
-from utils.data_loader import initialize_session_state, detect_dataset_type, load_csv_file
-from utils.helpers import get_dataset_info
+from utils.data_loader import initialize_session_state, detect_dataset_type, load_csv_bytes
+from utils.helpers import SITE_COLUMN
+from styles.dashboard_styles import apply_dashboard_styles
 
 # Configuración de la página
 st.set_page_config(
@@ -20,46 +16,87 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Configuración de estilo
-st.markdown("""
-<style>
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        text-align: center;
-        margin-bottom: 2rem;
-        color: #1f77b4;
-    }
-    .module-header {
-        font-size: 1.8rem;
-        font-weight: bold;
-        margin-bottom: 1rem;
-        color: #2e4057;
-    }
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 8px;
-    }
-    .stTabs [data-baseweb="tab"] {
-        height: 50px;
-        white-space: pre-wrap;
-        background-color: #f0f2f6;
-        border-radius: 4px 4px 0px 0px;
-        gap: 1px;
-        padding: 10px 12px;
-    }
-    .stTabs [aria-selected="true"] {
-        background-color: #1f77b4;
-        color: white;
-    }
-</style>
-""", unsafe_allow_html=True)
+# Configuración de estilo (CSS construido una sola vez por proceso)
+apply_dashboard_styles()
+
+# Encabezados estáticos (constantes, no se reconstruyen en cada rerun)
+MAIN_HEADER_HTML = '<h1 class="main-header">🌐 Dashboard - Network Management</h1>'
+OVERVIEW_HEADER_HTML = '<h2 class="module-header">🏠 Resumen general del sistema</h2>'
+
+# Tabs de módulos: nombre -> (módulo, función del dashboard, datasets que recibe)
+# Los módulos se importan de forma diferida al abrir su tab
+OVERVIEW_TAB = "🏠 Resumen"
+MODULE_TABS = {
+    "📊 Averías": ("modules.averias", "create_averias_dashboard", ("Averias", "Proyectos")),
+    "🚀 Desempeño": ("modules.desempeño", "create_performance_dashboard", ("Desempeño",)),
+    "⚙️ Configuración": ("modules.configuration", "create_configuration_dashboard", ("Configuration",)),
+    "🏗️ Provisión": ("modules.provision", "create_provision_dashboard", ("Provision",)),
+    "🟢 Disponibilidad": ("modules.disponibilidad", "create_availability_dashboard", ("Disponibilidad",)),
+    "⭐ Calidad": ("modules.calidad", "create_quality_dashboard", ("Calidad",))
+}
+
+def _datasets_fingerprint(datasets, file_ids):
+    """
+    Huella de los datasets cargados, usada como key de caché
+    
+    Se basa en el file_id del archivo subido de cada dataset: st.cache_data es
+    compartido entre sesiones y dos archivos con el mismo esquema y número de
+    filas no deben compartir resultados.
+    """
+    return tuple(
+        (name, file_ids.get(name)) if df is not None else (name, None)
+        for name, df in datasets.items()
+    )
+
+@st.cache_data(show_spinner=False)
+def _unique_sites_count(datasets_fingerprint, _datasets):
+    """Cuenta los sites únicos entre todos los datasets (solo se recalcula si cambian)"""
+    site_arrays = []
+    
+    for df in _datasets.values():
+        # Sites únicos (de múltiples fuentes, columna ya normalizada al cargar)
+        if df is not None and SITE_COLUMN in df.columns:
+            site_arrays.append(df[SITE_COLUMN].dropna().to_numpy(dtype=str))
+    
+    return len(pd.unique(np.concatenate(site_arrays))) if site_arrays else 0
+
+@st.fragment
+def _dataset_status_panel():
+    """Panel de estado de datasets en el sidebar, con rerun aislado del resto de la app"""
+    st.subheader("📋 Estado de Datasets")
+    
+    status_rows = []
+    for dataset_name in st.session_state["datasets"]:
+        meta = st.session_state["meta"].get(dataset_name)
+        status_rows.append({
+            "Estado": "✅" if meta else "❌",
+            "Dataset": dataset_name,
+            "Registros": meta[0] if meta else 0
+        })
+    
+    st.dataframe(pd.DataFrame(status_rows), use_container_width=True, hide_index=True)
+
+def _clear_datasets():
+    """Limpia los datasets en sitio; al ser callback, el rerun del botón ya refleja el cambio"""
+    datasets = st.session_state["datasets"]
+    for key in datasets:
+        datasets[key] = None
+    st.session_state["meta"].clear()
+    st.session_state["file_ids"].clear()
+    # La navegación de provisión pertenece al archivo descartado
+    st.session_state.pop("provision_drill_state", None)
 
 def main():
-    # Inicializar estado
-    initialize_session_state()
+    # Inicializar estado (una sola vez por sesión)
+    if "_initialized" not in st.session_state:
+        initialize_session_state()
+        st.session_state["_initialized"] = True
+    datasets = st.session_state["datasets"]
+    meta = st.session_state["meta"]
+    file_ids = st.session_state["file_ids"]
     
     # Título principal
-    st.markdown('<h1 class="main-header">🌐 Dashboard - Network Management</h1>', unsafe_allow_html=True)
+    st.markdown(MAIN_HEADER_HTML, unsafe_allow_html=True)
     
     # Sidebar para carga de archivos
     with st.sidebar:
@@ -75,16 +112,37 @@ def main():
         if uploaded_files:
             st.subheader("📊 Estado de Carga")
             
-            for file in uploaded_files:
-                dataset_type = detect_dataset_type(file.name)
-                
-                if dataset_type:
-                    df, error = load_csv_file(file)
+            # Los archivos son independientes: se parsean en paralelo y se muestran en orden.
+            # Los ya cargados (mismo file_id) no se vuelven a leer, así el DataFrame en
+            # session_state conserva su identidad entre reruns
+            # Tipo de dataset de cada archivo, detectado una sola vez
+            typed_files = [(file, detect_dataset_type(file.name)) for file in uploaded_files]
+            latest_file_ids = {
+                dataset_type: file.file_id
+                for file, dataset_type in typed_files if dataset_type
+            }
+            recognized_files = [
+                file for file, dataset_type in typed_files
+                if dataset_type and file_ids.get(dataset_type) != latest_file_ids[dataset_type]
+            ]
+            with ThreadPoolExecutor(max_workers=min(8, max(1, len(recognized_files)))) as executor:
+                futures = {
+                    id(file): executor.submit(load_csv_bytes, file.getvalue(), file.name)
+                    for file in recognized_files
+                }
+            
+            for file, dataset_type in typed_files:
+                if dataset_type and id(file) not in futures:
+                    st.success(f"✅ {dataset_type}: {meta[dataset_type][0]:,} registros")
+                elif dataset_type:
+                    df, error = futures[id(file)].result()
                     
                     if error:
                         st.error(f"❌ {file.name}: {error}")
                     else:
-                        st.session_state["datasets"][dataset_type] = df
+                        datasets[dataset_type] = df
+                        meta[dataset_type] = (len(df), len(df.columns))
+                        file_ids[dataset_type] = file.file_id
                         st.success(f"✅ {dataset_type}: {len(df):,} registros")
                 else:
                     st.warning(f"⚠️ {file.name}: Tipo no reconocido")
@@ -92,35 +150,33 @@ def main():
         st.divider()
         
         # Panel de estado de datasets
-        st.subheader("📋 Estado de Datasets")
-        
-        for dataset_name, dataset in st.session_state["datasets"].items():
-            status, rows, columns = get_dataset_info(dataset, dataset_name)
-            
-            if status == "Cargado":
-                st.success(f"✅ {dataset_name}: {rows:,} registros")
-            else:
-                st.error(f"❌ {dataset_name}: No cargado")
+        _dataset_status_panel()
         
         # Controles adicionales
-        if st.button("🗑️ Limpiar todos los datos", type="secondary"):
-            for key in st.session_state["datasets"]:
-                st.session_state["datasets"][key] = None
-            st.rerun()
+        st.button("🗑️ Limpiar todos los datos", type="secondary", on_click=_clear_datasets)
     
-    # Panel principal con tabs
-    tab_names = ["🏠 Resumen", "📊 Averías", "🚀 Desempeño", "⚙️ Configuración", "🏗️ Provisión", "🟢 Disponibilidad", "⭐ Calidad"]
-    tabs = st.tabs(tab_names)
+    # Panel principal: solo se ejecuta el dashboard de la vista seleccionada
+    active_tab = st.radio(
+        "Vista",
+        [OVERVIEW_TAB] + list(MODULE_TABS),
+        horizontal=True,
+        label_visibility="collapsed",
+        key="app_active_tab"
+    )
     
     # --- TAB OVERVIEW ---
-    with tabs[0]:
-        st.markdown('<h2 class="module-header">🏠 Resumen general del sistema</h2>', unsafe_allow_html=True)
+    if active_tab == OVERVIEW_TAB:
+        st.markdown(OVERVIEW_HEADER_HTML, unsafe_allow_html=True)
         
         # Métricas generales del sistema
         col1, col2, col3, col4 = st.columns(4)
         
-        datasets_loaded = sum(1 for df in st.session_state["datasets"].values() if df is not None)
-        total_records = sum(len(df) for df in st.session_state["datasets"].values() if df is not None)
+        datasets_loaded = len(meta)
+        total_records = sum(rows for rows, _ in meta.values())
+        unique_sites_count = _unique_sites_count(
+            _datasets_fingerprint(datasets, file_ids),
+            datasets
+        )
         
         with col1:
             st.metric("📁 Datasets cargados", f"{datasets_loaded}/7")
@@ -129,17 +185,7 @@ def main():
             st.metric("📋 Total de registros", f"{total_records:,}")
         
         with col3:
-            # Sites únicos (de múltiples fuentes)
-            unique_sites = set()
-            for dataset_name, df in st.session_state["datasets"].items():
-                if df is not None:
-                    site_cols = ["Site_Name", "site_name", "SITE_NAME", "site"]
-                    for col in site_cols:
-                        if col in df.columns:
-                            unique_sites.update(df[col].unique())
-                            break
-            
-            st.metric("🗼 Sites únicos", len(unique_sites))
+            st.metric("🗼 Sites únicos", unique_sites_count)
         
         with col4:
             st.metric("🕐 Última actualización", datetime.now().strftime("%H:%M"))
@@ -157,48 +203,28 @@ def main():
             ("Proyectos", "🗺️")
         ]
         
-        for i in range(0, len(modules_info), 3):
-            cols = st.columns(3)
-            
-            for j, col in enumerate(cols):
-                if i + j < len(modules_info):
-                    module_name, icon = modules_info[i + j]
-                    df = st.session_state["datasets"][module_name]
-                    
-                    with col:
-                        if df is not None:
-                            st.success(f"{icon} **{module_name}**")
-                            st.write(f"📋 {len(df):,} registros")
-                            st.write(f"📊 {len(df.columns)} columnas")
-                        else:
-                            st.error(f"{icon} **{module_name}**")
-                            st.write("📋 No cargado")
-    
-    # --- TABS DE MÓDULOS ---
-    
-    # Tab Averías
-    with tabs[1]:
-        create_averias_dashboard(st.session_state["datasets"]["Averias"], st.session_state["datasets"]["Proyectos"])
-    
-    # Tab Desempeño
-    with tabs[2]:
-        create_performance_dashboard(st.session_state["datasets"]["Desempeño"])
-    
-    # Tab Configuration
-    with tabs[3]:
-        create_configuration_dashboard(st.session_state["datasets"]["Configuration"])
-    
-    # Tab Provision
-    with tabs[4]:
-        create_provision_dashboard(st.session_state["datasets"]["Provision"])
-    
-    # Tab Disponibilidad
-    with tabs[5]:
-        create_availability_dashboard(st.session_state["datasets"]["Disponibilidad"])
+        # Tarjetas de todos los módulos en un único bloque HTML
+        module_cards = []
+        for module_name, icon in modules_info:
+            if module_name in meta:
+                rows, columns = meta[module_name]
+                module_cards.append(
+                    f"<div class='module-card card-ok'>{icon} <b>{module_name}</b>"
+                    f"<br>📋 {rows:,} registros<br>📊 {columns} columnas</div>"
+                )
+            else:
+                module_cards.append(
+                    f"<div class='module-card card-error'>{icon} <b>{module_name}</b>"
+                    f"<br>📋 No cargado</div>"
+                )
+        
+        st.markdown(f"<div class='module-grid'>{''.join(module_cards)}</div>", unsafe_allow_html=True)
     
-    # Tab Calidad
-    with tabs[6]:
-        create_quality_dashboard(st.session_state["datasets"]["Calidad"])
+    else:
+        # --- TABS DE MÓDULOS ---
+        module_path, function_name, dataset_names = MODULE_TABS[active_tab]
+        create_dashboard = getattr(importlib.import_module(module_path), function_name)
+        create_dashboard(*(datasets[name] for name in dataset_names))
 
 if __name__ == "__main__":
     main()
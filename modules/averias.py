@@ -4,15 +4,23 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import numpy as np
-from utils.helpers import find_site_column, parse_datetime_column
-from io import BytesIO
+import pyarrow.compute as pc
+from utils.helpers import SITE_COLUMN, find_site_column, parse_datetime_column, dataframe_to_excel_bytes, top_value_counts, date_range_slice, dataframe_to_csv_bytes, sorted_unique_values, count_value, isin_mask, arrow_case_map
 
+# Encabezado del módulo
+MODULE_HEADER_HTML = '<h2 class="module-header">📊 Análisis de Averías</h2>'
+
+# Máximo de puntos a enviar al mapa; por encima se agrupan por coordenadas redondeadas
+MAP_MAX_POINTS = 2000
+MAP_COORD_DECIMALS = 2
+
+@st.cache_data(show_spinner=False)
 def create_site_location_mapping(df_proyectos):
     """Crea un mapeo único de sites a ubicaciones geográficas"""
     if df_proyectos is None:
         return pd.DataFrame()
     
-    required_cols = ['SITE_NAME', 'Región', 'Provincia', 'Distrito', 'Localidad']
+    required_cols = [SITE_COLUMN, 'Región', 'Provincia', 'Distrito', 'Localidad']
     existing_cols = [col for col in required_cols if col in df_proyectos.columns]
     
     if len(existing_cols) < 2:
@@ -20,68 +28,113 @@ def create_site_location_mapping(df_proyectos):
     
     return df_proyectos[existing_cols].drop_duplicates()
 
+@st.cache_data(show_spinner=False)
+def create_geo_hierarchy(df_proyectos):
+    """Combinaciones únicas de Región/Provincia/Distrito/Localidad para las opciones de filtro"""
+    geo_cols = [col for col in ['Región', 'Provincia', 'Distrito', 'Localidad'] if col in df_proyectos.columns]
+    return df_proyectos[geo_cols].drop_duplicates().reset_index(drop=True)
+
+@st.cache_data(show_spinner=False)
+def filter_site_mapping(site_mapping, region_sel=None, provincia_sel=None, distrito_sel=None, localidad_sel=None):
+    """Aplica los filtros jerárquicos al mapeo de sites (cacheado por selección)"""
+    # Una sola máscara combinada: un único slice en lugar de uno por nivel
+    mask = np.ones(len(site_mapping), dtype=bool)
+    
+    for col, selection in (("Región", region_sel), ("Provincia", provincia_sel),
+                           ("Distrito", distrito_sel), ("Localidad", localidad_sel)):
+        if selection and col in site_mapping.columns:
+            mask &= site_mapping[col].isin(set(selection)).to_numpy()
+    
+    return site_mapping[mask]
+
 def filter_averias_by_geography(df_averias, df_proyectos, region_sel=None, provincia_sel=None, distrito_sel=None, localidad_sel=None):
     """
     Filtra averías por jerarquía geográfica sin duplicar registros
     """
-    if df_proyectos is None:
-        return df_averias.copy()
-    
-    # Crear mapeo único
-    required_cols = ['SITE_NAME', 'Región', 'Provincia', 'Distrito', 'Localidad']
-    existing_cols = [col for col in required_cols if col in df_proyectos.columns]
+    # Crear mapeo único (cacheado mientras no cambie el archivo de proyectos)
+    site_mapping = create_site_location_mapping(df_proyectos)
     
-    if len(existing_cols) < 2:
+    if len(site_mapping.columns) < 2:
         return df_averias.copy()
     
-    site_mapping = df_proyectos[existing_cols].drop_duplicates()
-    
     # Aplicar filtros jerárquicos al mapeo
-    filtered_mapping = site_mapping.copy()
-    
-    if region_sel and "Región" in filtered_mapping.columns:
-        filtered_mapping = filtered_mapping[filtered_mapping["Región"].isin(region_sel)]
-    if provincia_sel and "Provincia" in filtered_mapping.columns:
-        filtered_mapping = filtered_mapping[filtered_mapping["Provincia"].isin(provincia_sel)]
-    if distrito_sel and "Distrito" in filtered_mapping.columns:
-        filtered_mapping = filtered_mapping[filtered_mapping["Distrito"].isin(distrito_sel)]
-    if localidad_sel and "Localidad" in filtered_mapping.columns:
-        filtered_mapping = filtered_mapping[filtered_mapping["Localidad"].isin(localidad_sel)]
+    filtered_mapping = filter_site_mapping(site_mapping, region_sel, provincia_sel, distrito_sel, localidad_sel)
     
     # Obtener sites únicos que cumplen criterios geográficos
-    sites_validos = filtered_mapping["SITE_NAME"].unique()
+    sites_validos = filtered_mapping[SITE_COLUMN].unique()
     
     # Filtrar averías por estos sites
     site_column = find_site_column(df_averias)
     if site_column is None:
         return df_averias.copy()
     
-    df_filtered = df_averias[df_averias[site_column].isin(sites_validos)].copy()
+    # Sin copia previa: el merge ya construye un DataFrame nuevo
+    df_filtered = df_averias[isin_mask(df_averias[site_column], sites_validos)]
     
-    # Agregar información geográfica
-    site_geo_info = filtered_mapping.groupby("SITE_NAME").first().reset_index()
+    # Agregar información geográfica (solo el site y las columnas geográficas del mapeo)
+    geo_columns = [col for col in ('Región', 'Provincia', 'Distrito', 'Localidad') if col in filtered_mapping.columns]
+    site_geo_info = filtered_mapping[[SITE_COLUMN] + geo_columns].drop_duplicates(subset=[SITE_COLUMN], keep="first")
     df_result = df_filtered.merge(
         site_geo_info,
         how="left",
         left_on=site_column,
-        right_on="SITE_NAME"
+        right_on=SITE_COLUMN,
+        validate="m:1"
     )
     
     return df_result
 
-def create_averias_dashboard(df_averias, df_proyectos):
-    """
-    Crea el dashboard completo de averías
+@st.cache_data(show_spinner=False)
+def build_excel_download(df_export, sheet_name):
+    """Genera un Excel de descarga, cacheado por contenido del DataFrame"""
+    return dataframe_to_excel_bytes(df_export, sheet_name)
+
+def horizontal_bar_figure(values, labels, title, x_title, colorscale):
     """
-    st.markdown('<h2 class="module-header">📊 Análisis de Averías</h2>', unsafe_allow_html=True)
+    Crea un gráfico de barras horizontales para rankings de sites (top 10)
     
-    if df_averias is None:
-        st.warning("⚠️ No se ha cargado el archivo de Averías")
-        st.info("Sube un archivo CSV desde el panel lateral para ver el análisis.")
-        return
+    Se construye con go.Bar directamente, sin la introspección de columnas de px.bar.
     
-    # === FORMATEAR DATASET ===
-    df_formatted = df_averias.copy()
+    Args:
+        values: Valores de las barras
+        labels: Nombres de los sites
+        title: Título del gráfico
+        x_title: Título del eje X
+        colorscale: Escala de colores según el valor
+        
+    Returns:
+        Figura de Plotly
+    """
+    values = np.asarray(values)
+    fig = go.Figure(go.Bar(
+        x=values,
+        y=[str(label) for label in labels],
+        orientation='h',
+        marker=dict(color=values, colorscale=colorscale, showscale=True)
+    ))
+    fig.update_layout(
+        title=title,
+        xaxis_title=x_title,
+        yaxis_title='Site',
+        height=400,
+        showlegend=False,
+        yaxis={'categoryorder': 'total ascending'}
+    )
+    return fig
+
+def preprocess_averias(df_averias):
+    """
+    Normaliza el DataFrame de averías: columnas, formatos, tipos y fechas
+    
+    Args:
+        df_averias: DataFrame de averías tal como se cargó
+        
+    Returns:
+        Tuple: (DataFrame procesado, columna de sites, éxito del parseo de start_time)
+    """
+    # Copia superficial: las columnas formateadas se reemplazan enteras, sin
+    # modificar los datos del DataFrame en session_state ni duplicar el resto
+    df_formatted = df_averias.copy(deep=False)
     
     # Normalizar nombres de columnas a minúsculas
     df_formatted.columns = df_formatted.columns.str.lower()
@@ -90,13 +143,26 @@ def create_averias_dashboard(df_averias, df_proyectos):
     geo_columns = ['región', 'provincia', 'distrito', 'localidad', 'region']
     for col in geo_columns:
         if col in df_formatted.columns:
-            df_formatted[col] = df_formatted[col].astype(str).str.upper()
+            df_formatted[col] = arrow_case_map(df_formatted[col], pc.utf8_upper)
     
     # Formatear columnas de estado
     status_columns = ['alarm_status', 'status', 'estado']
     for col in status_columns:
         if col in df_formatted.columns:
-            df_formatted[col] = df_formatted[col].astype(str).str.lower()
+            df_formatted[col] = arrow_case_map(df_formatted[col], pc.utf8_lower)
+    
+    # Columna de sites (se conserva en todos los DataFrames filtrados derivados)
+    site_col = find_site_column(df_formatted)
+    
+    # Columnas de baja cardinalidad como category (comparaciones, isin y groupby sobre códigos)
+    categorical_columns = [
+        col for col in geo_columns + status_columns + ['alarm_name', 'cell_name']
+        if col in df_formatted.columns
+    ]
+    if site_col:
+        categorical_columns.append(site_col)
+    for col in categorical_columns:
+        df_formatted[col] = df_formatted[col].astype('category')
     
     # Usar dataset formateado de aquí en adelante
     df_averias = df_formatted
@@ -104,9 +170,40 @@ def create_averias_dashboard(df_averias, df_proyectos):
     # Convertir start_time y end_time
     df_averias, start_time_date_conversion_success = parse_datetime_column(df_averias, "start_time")
     df_averias, _ = parse_datetime_column(df_averias, "end_time", create_derived_fields=False)
-        
-    # Usar el DataFrame principal para el resto del análisis
-    df_averias_processed = df_averias
+    
+    # Asegurar datetime64[ns] en origen para operar con arrays NumPy más adelante
+    if start_time_date_conversion_success and df_averias["start_time"].dtype != "datetime64[ns]":
+        df_averias["start_time"] = df_averias["start_time"].astype("datetime64[ns]")
+    
+    # Eliminar duplicados si existe alarm_id (una sola vez, antes de filtrar: los
+    # conteos no dependen de los filtros aplicados)
+    if "alarm_id" in df_averias.columns:
+        df_averias = df_averias.drop_duplicates(subset=["alarm_id"]).reset_index(drop=True)
+    
+    # Orden cronológico: los filtros de fecha se resuelven con searchsorted
+    if start_time_date_conversion_success:
+        df_averias = df_averias.sort_values("start_time", kind="stable").reset_index(drop=True)
+    
+    return df_averias, site_col, start_time_date_conversion_success
+
+def create_averias_dashboard(df_averias, df_proyectos):
+    """
+    Crea el dashboard completo de averías
+    """
+    st.markdown(MODULE_HEADER_HTML, unsafe_allow_html=True)
+    
+    if df_averias is None:
+        st.warning("⚠️ No se ha cargado el archivo de Averías")
+        st.info("Sube un archivo CSV desde el panel lateral para ver el análisis.")
+        return
+    
+    # === FORMATEAR DATASET ===
+    # El preprocesado se guarda en session_state y se reutiliza mientras no cambie el archivo
+    cached = st.session_state.get("averias_preprocessed")
+    if cached is None or cached[0] is not df_averias:
+        cached = (df_averias, preprocess_averias(df_averias))
+        st.session_state["averias_preprocessed"] = cached
+    df_averias_processed, site_col, start_time_date_conversion_success = cached[1]
     
     # Métricas iniciales
     col1, col2, col3, col4 = st.columns(4)
@@ -116,7 +213,8 @@ def create_averias_dashboard(df_averias, df_proyectos):
     
     with col2:
         if "alarm_status" in df_averias_processed.columns:
-            averias_activas = len(df_averias_processed[df_averias_processed["alarm_status"] == "active"])
+            averias_activas_all = df_averias_processed[(df_averias_processed["alarm_status"] == "active").to_numpy()]
+            averias_activas = len(averias_activas_all)
             
             # Métrica arriba
             st.metric("Averías Activas", averias_activas)
@@ -124,8 +222,6 @@ def create_averias_dashboard(df_averias, df_proyectos):
             # Botón debajo (solo si hay averías)
             if averias_activas > 0:
                 # Preparar datos
-                averias_activas_all = df_averias_processed[df_averias_processed["alarm_status"] == "active"]
-                site_col = find_site_column(averias_activas_all)
                 essential_columns = ["start_time", "end_time"]
                 if site_col:
                     essential_columns.append(site_col)
@@ -136,15 +232,8 @@ def create_averias_dashboard(df_averias, df_proyectos):
                 if "start_time" in averias_activas_all.columns:
                     averias_activas_all = averias_activas_all.sort_values("start_time", ascending=True)
                 
-                # Crear Excel
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                    averias_activas_all[download_columns].to_excel(
-                        writer, 
-                        sheet_name='Averias_Activas', 
-                        index=False
-                    )
-                excel_data = buffer.getvalue()
+                # Crear Excel (solo se regenera si cambian los datos)
+                excel_data = build_excel_download(averias_activas_all[download_columns], 'Averias_Activas')
                 
                 # Botón de descarga
                 st.download_button(
@@ -159,7 +248,6 @@ def create_averias_dashboard(df_averias, df_proyectos):
             st.metric("Averías Activas", "N/A")
 
     with col3:
-        site_col = find_site_column(df_averias_processed)
         if site_col:
             st.metric("Sites Únicos", df_averias_processed[site_col].nunique())
         else:
@@ -177,12 +265,13 @@ def create_averias_dashboard(df_averias, df_proyectos):
         
         filter_col1, filter_col2, filter_col3, filter_col4 = st.columns(4)
         
-        # Filtros jerárquicos
-        df_temp = df_proyectos.copy()
+        # Filtros jerárquicos sobre las combinaciones geográficas únicas (cacheadas),
+        # no sobre todas las filas de proyectos
+        df_temp = create_geo_hierarchy(df_proyectos)
         
         with filter_col1:
-            if "Región" in df_proyectos.columns:
-                regiones = sorted(df_proyectos["Región"].dropna().unique())
+            if "Región" in df_temp.columns:
+                regiones = sorted(df_temp["Región"].dropna().unique())
                 region_sel = st.multiselect("🌍 Región", regiones, key="averias_region")
                 if region_sel:
                     df_temp = df_temp[df_temp["Región"].isin(region_sel)]
@@ -221,14 +310,17 @@ def create_averias_dashboard(df_averias, df_proyectos):
                 region_sel, provincia_sel, distrito_sel, localidad_sel
             )
         else:
-            df_filtrado = df_averias_processed.copy()
+            # Sin filtros: se usa la referencia, el resto del dashboard solo lee df_filtrado
+            df_filtrado = df_averias_processed
     else:
-        df_filtrado = df_averias_processed.copy()
+        df_filtrado = df_averias_processed
         st.info("ℹ️ Carga el archivo de Proyectos para usar filtros geográficos")
     
-    # Eliminar duplicados si existe alarm_id
-    if "alarm_id" in df_filtrado.columns:
-        df_filtrado = df_filtrado.drop_duplicates(subset=["alarm_id"])
+    # Averías activas filtradas: la máscara se calcula una sola vez y se reutiliza
+    if "alarm_status" in df_filtrado.columns:
+        averias_activas = df_filtrado[(df_filtrado["alarm_status"] == "active").to_numpy()]
+    else:
+        averias_activas = None
     
     result_col1, result_col2, result_col3 = st.columns(3)
     with result_col1:
@@ -237,11 +329,10 @@ def create_averias_dashboard(df_averias, df_proyectos):
     
     with result_col2:
         if "alarm_status" in df_filtrado.columns:
-            activas_filtradas = len(df_filtrado[df_filtrado["alarm_status"] == "active"])
+            activas_filtradas = len(averias_activas)
             st.metric("Activas Filtradas", activas_filtradas)
     
     with result_col3:
-        site_col = find_site_column(df_filtrado)
         if site_col:
             sites_filtrados = df_filtrado[site_col].nunique()
             st.metric("Sites Únicos", sites_filtrados)
@@ -252,18 +343,21 @@ def create_averias_dashboard(df_averias, df_proyectos):
         averias_resueltas = df_filtrado.dropna(subset=["duration_minutes"])
         
         if len(averias_resueltas) > 0:
+            # Estadísticas globales en una sola agregación
+            duration_stats = averias_resueltas["duration_minutes"].agg(['mean', 'median', 'max'])
+            
             tiempo_col1, tiempo_col2, tiempo_col3 = st.columns(3)
             
             with tiempo_col1:
-                avg_resolution = averias_resueltas["duration_minutes"].mean()
+                avg_resolution = duration_stats['mean']
                 st.metric("⏱️ Tiempo Promedio Global", f"{avg_resolution:.1f} min")
             
             with tiempo_col2:
-                median_resolution = averias_resueltas["duration_minutes"].median()
+                median_resolution = duration_stats['median']
                 st.metric("📊 Tiempo Mediano", f"{median_resolution:.1f} min")
             
             with tiempo_col3:
-                max_resolution = averias_resueltas["duration_minutes"].max()
+                max_resolution = duration_stats['max']
                 st.metric("⚠️ Mayor Tiempo", f"{max_resolution:.1f} min")
 
             # Top/Bottom sites por tiempo de resolución
@@ -271,51 +365,45 @@ def create_averias_dashboard(df_averias, df_proyectos):
             
             with ranking_col1:
                 # Sites con mayor tiempo de resolución
-                site_avg_time = averias_resueltas.groupby(site_col)["duration_minutes"].agg(['mean', 'count']).reset_index()
+                site_avg_time = averias_resueltas.groupby(site_col, sort=False, observed=True)["duration_minutes"].agg(['mean', 'count']).reset_index()
                 site_avg_time = site_avg_time[site_avg_time['count'] >= 3]  # Solo sites con 3+ averías
                 top_slow = site_avg_time.nlargest(10, 'mean')
                 
                 if len(top_slow) > 0:
-                    fig_slow = px.bar(
-                        top_slow,
-                        x='mean',
-                        y=site_col,
-                        orientation='h',
+                    fig_slow = horizontal_bar_figure(
+                        top_slow['mean'],
+                        top_slow[site_col],
                         title="🌊 Sites con Mayor Tiempo de Resolución",
-                        labels={'mean': 'Tiempo Promedio (min)', site_col: 'Site'},
-                        color='mean',
-                        color_continuous_scale='Reds'
+                        x_title='Tiempo Promedio (min)',
+                        colorscale='Reds'
                     )
-                    fig_slow.update_layout(height=400)
                     st.plotly_chart(fig_slow, use_container_width=True)
             
             with ranking_col2:
                 # Sites con averías activas con más tiempo abierto
-                if "alarm_status" in df_filtrado.columns:
-                    averias_activas_actual = df_filtrado[df_filtrado["alarm_status"] == "active"]
-                    
-                    if len(averias_activas_actual) > 0 and "start_time" in averias_activas_actual.columns:
+                if averias_activas is not None:
+                    if len(averias_activas) > 0 and "start_time" in averias_activas.columns:
                         # Calcular tiempo transcurrido desde inicio de avería activa
-                        now = pd.Timestamp.now()
-                        averias_activas_actual['tiempo_abierto_horas'] = (now - averias_activas_actual['start_time']).dt.total_seconds() / 3600
+                        # (resta datetime64 directa en NumPy, sin pasar por el accessor .dt)
+                        start_ns = averias_activas['start_time'].to_numpy(dtype='datetime64[ns]')
+                        now_ns = pd.Timestamp.now().to_datetime64().astype('datetime64[ns]')
+                        horas = (now_ns - start_ns).astype('int64') * (1.0 / 3_600_000_000_000)
+                        horas[np.isnat(start_ns)] = np.nan
+                        tiempo_abierto_horas = pd.Series(horas, index=averias_activas.index)
                         
                         # Agrupar por site y obtener el promedio de tiempo abierto
-                        site_tiempo_abierto = averias_activas_actual.groupby(site_col)['tiempo_abierto_horas'].agg(['mean', 'count']).reset_index()
+                        site_tiempo_abierto = tiempo_abierto_horas.groupby(averias_activas[site_col], observed=True).agg(['mean', 'count']).reset_index()
                         site_tiempo_abierto = site_tiempo_abierto[site_tiempo_abierto['count'] >= 1]  # Al menos 1 avería activa
                         top_tiempo_abierto = site_tiempo_abierto.nlargest(10, 'mean')
                         
                         if len(top_tiempo_abierto) > 0:
-                            fig_tiempo_abierto = px.bar(
-                                top_tiempo_abierto,
-                                x='mean',
-                                y=site_col,
-                                orientation='h',
+                            fig_tiempo_abierto = horizontal_bar_figure(
+                                top_tiempo_abierto['mean'],
+                                top_tiempo_abierto[site_col],
                                 title="⏰ Sites con averías activas más tiempo abierto",
-                                labels={'mean': 'Tiempo promedio abierto (horas)', site_col: 'Site'},
-                                color='mean',
-                                color_continuous_scale='Oranges'
+                                x_title='Tiempo promedio abierto (horas)',
+                                colorscale='Oranges'
                             )
-                            fig_tiempo_abierto.update_layout(height=400)
                             st.plotly_chart(fig_tiempo_abierto, use_container_width=True)
                         else:
                             st.info("No hay suficientes averías activas para mostrar")
@@ -358,7 +446,6 @@ def create_averias_dashboard(df_averias, df_proyectos):
             st.plotly_chart(fig_hist, use_container_width=True)
 
     # === TOP SITES EN DOS COLUMNAS ===
-    site_col = find_site_column(df_filtrado)
     if site_col:
         st.subheader("🏆 Top Sites con averías")
         
@@ -366,42 +453,34 @@ def create_averias_dashboard(df_averias, df_proyectos):
         
         with sites_col1:
             # Top sites con más averías totales
-            top_sites_total = df_filtrado[site_col].value_counts().head(10)
+            top_sites_total = top_value_counts(df_filtrado[site_col], 10)
             
             if len(top_sites_total) > 0:
-                fig_top_sites_total = px.bar(
-                    x=top_sites_total.values,
-                    y=top_sites_total.index,
-                    orientation='h',
+                fig_top_sites_total = horizontal_bar_figure(
+                    top_sites_total.values,
+                    top_sites_total.index,
                     title="📊 Top 10 Sites - Averías Totales",
-                    labels={'x': 'Número de Averías', 'y': 'Site'},
-                    color=top_sites_total.values,
-                    color_continuous_scale='Blues'
+                    x_title='Número de Averías',
+                    colorscale='Blues'
                 )
-                fig_top_sites_total.update_layout(height=400, showlegend=False, yaxis={'categoryorder':'total ascending'})
                 st.plotly_chart(fig_top_sites_total, use_container_width=True)
             else:
                 st.info("No hay datos de averías para mostrar")
         
         with sites_col2:
             # Top sites con más averías activas
-            if "alarm_status" in df_filtrado.columns:
-                averias_activas = df_filtrado[df_filtrado["alarm_status"] == "active"]
-                
+            if averias_activas is not None:
                 if len(averias_activas) > 0:
-                    top_sites_activas = averias_activas[site_col].value_counts().head(10)
+                    top_sites_activas = top_value_counts(averias_activas[site_col], 10)
                     
                     if len(top_sites_activas) > 0:
-                        fig_top_sites_activas = px.bar(
-                            x=top_sites_activas.values,
-                            y=top_sites_activas.index[::-1],  # Invertir orden para mostrar descendente
-                            orientation='h',
+                        fig_top_sites_activas = horizontal_bar_figure(
+                            top_sites_activas.values,
+                            top_sites_activas.index,
                             title="🚨 Top 10 Sites - Averías Activas",
-                            labels={'x': 'Número de Averías Activas', 'y': 'Site'},
-                            color=top_sites_activas.values,
-                            color_continuous_scale='Reds'
+                            x_title='Número de Averías Activas',
+                            colorscale='Reds'
                         )
-                        fig_top_sites_activas.update_layout(height=400, showlegend=False, yaxis={'categoryorder':'total ascending'})
                         st.plotly_chart(fig_top_sites_activas, use_container_width=True)
                     else:
                         st.info("No hay averías activas en los sites filtrados")
@@ -451,11 +530,8 @@ def create_averias_dashboard(df_averias, df_proyectos):
         st.subheader("🗺️ Mapa de Averías Activas")
         
         # Filtrar solo averías activas
-        if "alarm_status" in df_filtrado.columns:
-            averias_activas = df_filtrado[df_filtrado["alarm_status"] == "active"]
-            
+        if averias_activas is not None:
             if len(averias_activas) > 0:
-                site_col = find_site_column(averias_activas)
                 if site_col:
                     # Obtener sites únicos con averías activas
                     sites_activos = averias_activas[site_col].unique()
@@ -476,7 +552,7 @@ def create_averias_dashboard(df_averias, df_proyectos):
                     if coord_cols:
                         # Filtrar proyectos que tienen averías activas
                         proyectos_activos = df_proyectos[
-                            df_proyectos["SITE_NAME"].isin(sites_activos)
+                            df_proyectos[SITE_COLUMN].isin(sites_activos)
                         ].copy()
                         
                         # Limpiar y convertir coordenadas
@@ -494,25 +570,24 @@ def create_averias_dashboard(df_averias, df_proyectos):
                                     alarm_name_col = col
                                     break
                             
-                            # Crear lista de columnas para el merge
-                            merge_cols = [site_col]
+                            # Agregar por site antes del merge (un punto por site, sin multiplicar filas)
+                            grouped_activas = averias_activas.groupby(site_col, sort=False, observed=True)
+                            alarmas_por_site = grouped_activas.size().to_frame("num_alarmas")
                             if alarm_name_col:
-                                merge_cols.append(alarm_name_col)
+                                alarmas_por_site[alarm_name_col] = grouped_activas[alarm_name_col].first()
                             if "start_time" in averias_activas.columns:
-                                merge_cols.append("start_time")
+                                alarmas_por_site["start_time"] = grouped_activas["start_time"].max()
+                            alarmas_por_site = alarmas_por_site.reset_index()
                             
                             # Agregar información de averías al mapa
                             mapa_data = proyectos_mapa.merge(
-                                averias_activas[merge_cols],
-                                left_on="SITE_NAME",
+                                alarmas_por_site,
+                                left_on=SITE_COLUMN,
                                 right_on=site_col,
-                                how="inner"
+                                how="inner",
+                                validate="m:1"
                             )
                             
-                            # Contar averías por site
-                            alarmas_por_site = averias_activas.groupby(site_col).size().reset_index(name='num_alarmas')
-                            mapa_data = mapa_data.merge(alarmas_por_site, left_on="SITE_NAME", right_on=site_col, how="left")
-                            
                             # Preparar datos para hover
                             hover_data = {
                                 "lat": False,
@@ -529,16 +604,55 @@ def create_averias_dashboard(df_averias, df_proyectos):
                                 if col in mapa_data.columns:
                                     hover_data[col] = True
                             
+                            # Con muchos sites, agrupar puntos cercanos para aligerar el payload del mapa
+                            mapa_plot = mapa_data
+                            map_title = f"🚨 {len(mapa_data)} Sites con Averías Activas"
+                            if len(mapa_data) > MAP_MAX_POINTS:
+                                mapa_plot = mapa_data.assign(
+                                    lat=mapa_data["lat"].round(MAP_COORD_DECIMALS),
+                                    lon=mapa_data["lon"].round(MAP_COORD_DECIMALS)
+                                )
+                                descriptive_columns = [
+                                    col for col in mapa_plot.columns
+                                    if col not in ("lat", "lon", "num_alarmas", SITE_COLUMN)
+                                ]
+                                grouped_points = mapa_plot.groupby(["lat", "lon"], sort=False)
+                                mapa_plot = grouped_points.agg(
+                                    **{col: (col, "first") for col in [SITE_COLUMN] + descriptive_columns},
+                                    num_alarmas=("num_alarmas", "sum"),
+                                    num_sites=(SITE_COLUMN, "size")
+                                )
+                                
+                                # Campos que difieren entre los sites de un mismo punto: "Varios"
+                                if descriptive_columns:
+                                    varies = (grouped_points[descriptive_columns].nunique(dropna=False) > 1).to_numpy()
+                                    for i, col in enumerate(descriptive_columns):
+                                        if varies[:, i].any():
+                                            mapa_plot[col] = mapa_plot[col].astype(object).mask(varies[:, i], "Varios")
+                                
+                                # Los puntos con varios sites se rotulan como grupo
+                                is_group = mapa_plot["num_sites"].to_numpy() > 1
+                                mapa_plot[SITE_COLUMN] = mapa_plot[SITE_COLUMN].astype(str).mask(
+                                    is_group, "Grupo de " + mapa_plot["num_sites"].astype(str) + " sites"
+                                )
+                                mapa_plot = mapa_plot.reset_index()
+                                
+                                hover_data["num_sites"] = True
+                                map_title = (
+                                    f"🚨 {len(mapa_data)} Sites con Averías Activas "
+                                    f"(agrupados en {len(mapa_plot)} puntos por cercanía)"
+                                )
+                            
                             # Crear mapa con plotly - USANDO PUNTOS SIMPLES
                             fig_mapa = px.scatter_mapbox(
-                                mapa_data,
+                                mapa_plot,
                                 lat="lat",
                                 lon="lon",
-                                hover_name="SITE_NAME",
+                                hover_name=SITE_COLUMN,
                                 hover_data=hover_data,
-                                color="Región" if "Región" in mapa_data.columns else "num_alarmas",
+                                color="Región" if "Región" in mapa_plot.columns else "num_alarmas",
                                 zoom=5,
-                                title=f"🚨 {len(mapa_data)} Sites con Averías Activas"
+                                title=map_title
                             )
                             
                             # Si no hay región para colorear, usar escala de rojos para num_alarmas
@@ -555,7 +669,7 @@ def create_averias_dashboard(df_averias, df_proyectos):
                                 mapbox_style="open-street-map",
                                 height=600,
                                 showlegend=True,
-                                title=f"🚨 {len(mapa_data)} Sites con Averías Activas",
+                                title=map_title,
                                 mapbox=dict(
                                     center=dict(lat=-9.19, lon=-75.02),  # Centro de Perú
                                     zoom=5
@@ -606,15 +720,18 @@ def create_averias_dashboard(df_averias, df_proyectos):
     st.subheader("🔍 Filtros Adicionales")
     
     # Aplicar filtros paso a paso
-    df_temp_filtros = df_filtrado.copy()
+    # Solo lectura: cada filtro crea un DataFrame nuevo, no hace falta copiar
+    df_temp_filtros = df_filtrado
     
     # === FILTRO POR RANGO DE FECHAS ===
     if "start_time" in df_filtrado.columns and start_time_date_conversion_success:
         st.markdown("**📅 Filtro por Rango de Fechas**")
         
-        # Obtener rango de fechas disponible
-        min_date = df_filtrado["start_time"].min().date()
-        max_date = df_filtrado["start_time"].max().date()
+        # Obtener rango de fechas disponible (reducción directa sobre datetime64, sin NaT)
+        start_values = df_filtrado["start_time"].to_numpy()
+        start_values = start_values[~np.isnat(start_values)]
+        min_date = pd.Timestamp(start_values.min()).date()
+        max_date = pd.Timestamp(start_values.max()).date()
         
         date_col1, date_col2 = st.columns(2)
         
@@ -639,10 +756,10 @@ def create_averias_dashboard(df_averias, df_proyectos):
         # Validar y aplicar filtro de fechas
         if fecha_inicio <= fecha_fin:
             # Filtrar por rango de fechas
-            df_temp_filtros = df_temp_filtros[
-                (df_temp_filtros["start_time"].dt.date >= fecha_inicio) &
-                (df_temp_filtros["start_time"].dt.date <= fecha_fin)
-            ].copy()
+            # (df_temp_filtros conserva el orden por start_time del preprocesado)
+            df_temp_filtros = df_temp_filtros.iloc[
+                date_range_slice(df_temp_filtros["start_time"], fecha_inicio, fecha_fin)
+            ]
             
             # Mostrar métricas del filtro de fechas
             date_metrics_col1, date_metrics_col2, date_metrics_col3 = st.columns(3)
@@ -653,7 +770,7 @@ def create_averias_dashboard(df_averias, df_proyectos):
             
             with date_metrics_col2:
                 if "alarm_status" in df_temp_filtros.columns:
-                    activas_rango = len(df_temp_filtros[df_temp_filtros["alarm_status"] == "active"])
+                    activas_rango = count_value(df_temp_filtros["alarm_status"], "active")
                     st.metric("Activas en rango", activas_rango)
             
             with date_metrics_col3:
@@ -665,12 +782,11 @@ def create_averias_dashboard(df_averias, df_proyectos):
         st.info("ℹ️ No hay datos de fecha válidos para aplicar filtro temporal")
     
     # === FILTRO POR SITE NAME ===
-    site_col = find_site_column(df_temp_filtros)
     if site_col:
         st.markdown("**🏗️ Filtro por Site Name**")
         
         # Obtener lista de sites únicos en los datos filtrados por fecha
-        sites_disponibles = sorted(df_temp_filtros[site_col].dropna().unique())
+        sites_disponibles = sorted_unique_values(df_temp_filtros[site_col])
         
         if sites_disponibles:
             site_filter_col1, site_filter_col2 = st.columns([3, 1])
@@ -697,8 +813,8 @@ def create_averias_dashboard(df_averias, df_proyectos):
             # Aplicar filtro de sites si hay selección
             if sites_seleccionados:
                 df_temp_filtros = df_temp_filtros[
-                    df_temp_filtros[site_col].isin(sites_seleccionados)
-                ].copy()
+                    isin_mask(df_temp_filtros[site_col], sites_seleccionados)
+                ]
                 
                 # Mostrar métricas del filtro de sites
                 site_metrics_col1, site_metrics_col2, site_metrics_col3 = st.columns(3)
@@ -712,7 +828,7 @@ def create_averias_dashboard(df_averias, df_proyectos):
                 
                 with site_metrics_col3:
                     if "alarm_status" in df_temp_filtros.columns:
-                        activas_sites = len(df_temp_filtros[df_temp_filtros["alarm_status"] == "active"])
+                        activas_sites = count_value(df_temp_filtros["alarm_status"], "active")
                         st.metric("Activas filtradas", activas_sites)
         else:
             st.warning("⚠️ No hay sites disponibles en el rango de fechas seleccionado")
@@ -743,33 +859,37 @@ def create_averias_dashboard(df_averias, df_proyectos):
         display_columns = [col for col in essential_columns if col in df_tabla.columns]
     
     # Mostrar datos
-    st.dataframe(df_tabla[display_columns].head(max_rows), use_container_width=True, hide_index=True)
-    
-    # Botones de descarga
-    download_col1, download_col2 = st.columns(2)
-    
-    with download_col1:
-        # Botón de descarga CSV
-        csv = df_tabla.to_csv(index=False)
-        st.download_button(
-            label="📥 Descargar CSV",
-            data=csv,
-            file_name=f"averias_filtradas_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-            mime="text/csv",
-            key="averias_download_filtered_csv"
-        )
-    
-    with download_col2:
-        # Botón de descarga Excel
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df_tabla.to_excel(writer, sheet_name='Averias_Filtradas', index=False)
-        excel_data = buffer.getvalue()
+    st.dataframe(df_tabla.iloc[:max_rows].loc[:, display_columns], use_container_width=True, hide_index=True)
+    
+    # Botones de descarga: los archivos solo se generan si el usuario los prepara
+    prepare_downloads = st.checkbox(
+        "📦 Preparar archivos de descarga",
+        value=False,
+        key="averias_prepare_downloads"
+    )
+    
+    if prepare_downloads:
+        download_col1, download_col2 = st.columns(2)
+        
+        with download_col1:
+            # Botón de descarga CSV
+            csv = dataframe_to_csv_bytes(df_tabla)
+            st.download_button(
+                label="📥 Descargar CSV",
+                data=csv,
+                file_name=f"averias_filtradas_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv",
+                key="averias_download_filtered_csv"
+            )
         
-        st.download_button(
-            label="📥 Descargar Excel",
-            data=excel_data,
-            file_name=f"averias_filtradas_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key="averias_download_filtered_excel"
-        )
\ No newline at end of file
+        with download_col2:
+            # Botón de descarga Excel (solo se regenera si cambian los datos)
+            excel_data = build_excel_download(df_tabla, 'Averias_Filtradas')
+            
+            st.download_button(
+                label="📥 Descargar Excel",
+                data=excel_data,
+                file_name=f"averias_filtradas_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="averias_download_filtered_excel"
+            )
\ No newline at end of file
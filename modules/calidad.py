@@ -1,34 +1,91 @@
 import streamlit as st
-import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-from utils.helpers import find_site_column, clean_numeric_data, parse_datetime_column
+from utils.helpers import find_site_column, clean_numeric_data, parse_datetime_column, date_range_slice, dataframe_to_csv_bytes, isin_mask, site_hour_averages, grouped_means, sorted_unique_values, normalize_metrics, summary_statistics, SUMMARY_STATS_COLUMN_CONFIG
+from utils.data_loader import LOADED_FILES_CACHE_ENTRIES
+
+# Encabezado del módulo
+MODULE_HEADER_HTML = '<h2 class="module-header">⭐ Análisis de Calidad</h2>'
+
+# Variables numéricas disponibles
+NUMERIC_COLUMNS = [
+    "lte_rrc_setup_suc", "lte_rrc_attempt", "fails_rrc_setup", "lte_rrc_sr",
+    "init_e_rab_suc_setup", "add_e_rab_suc_setup", "add_e_rab_setup_att", 
+    "init_e_rab_setup_att", "lte_e_rab_sr", "lte_call_drop", 
+    "lte_call_attempt", "lte_cdr"
+]
+
+# Nombres amigables de las métricas
+METRIC_LABELS = {
+    "lte_rrc_setup_suc": "📶 RRC Setup Success",
+    "lte_rrc_attempt": "📶 RRC Attempts",
+    "fails_rrc_setup": "❌ RRC Setup Fails",
+    "lte_rrc_sr": "📊 RRC Success Rate (%)",
+    "init_e_rab_suc_setup": "🔗 Initial E-RAB Success",
+    "add_e_rab_suc_setup": "➕ Additional E-RAB Success",
+    "add_e_rab_setup_att": "➕ Additional E-RAB Attempts",
+    "init_e_rab_setup_att": "🔗 Initial E-RAB Attempts",
+    "lte_e_rab_sr": "📊 E-RAB Success Rate (%)",
+    "lte_call_drop": "📞 Call Drops",
+    "lte_call_attempt": "📞 Call Attempts",
+    "lte_cdr": "📉 Call Drop Rate (%)"
+}
+
+# Mismos nombres indexados también por las columnas normalizadas (*_norm)
+METRIC_LABELS_NORM = {**METRIC_LABELS, **{f"{metric}_norm": label for metric, label in METRIC_LABELS.items()}}
+
+@st.cache_data(show_spinner=False, max_entries=LOADED_FILES_CACHE_ENTRIES)
+def prepare_quality_data(file_id, _df_quality):
+    """
+    Limpia numéricos y parsea fechas una sola vez por archivo subido
+    
+    Args:
+        file_id: Identificador del archivo subido (key de caché)
+        _df_quality: DataFrame de calidad (no se hashea)
+        
+    Returns:
+        Tuple: (DataFrame procesado, éxito del parseo de start_time)
+    """
+    df_clean = clean_numeric_data(_df_quality, NUMERIC_COLUMNS)
+    
+    # Columnas de baja cardinalidad como category (isin y groupby sobre códigos)
+    site_col = find_site_column(df_clean)
+    for col in (site_col, "cell_name"):
+        if col and col in df_clean.columns:
+            df_clean[col] = df_clean[col].astype("category")
+    
+    df_clean, date_conversion_success = parse_datetime_column(df_clean, "start_time")
+    
+    # Orden cronológico: los filtros de fecha se resuelven con searchsorted
+    if date_conversion_success:
+        df_clean = df_clean.sort_values("start_time", kind="stable").reset_index(drop=True)
+    
+    # Hora como int8 (se agrupa por ella en cada rerun); con NaT se deja como float
+    if "hour" in df_clean.columns and df_clean["hour"].notna().all():
+        df_clean["hour"] = df_clean["hour"].astype("int8")
+    
+    return df_clean, date_conversion_success
 
 def create_quality_dashboard(df_quality):
     """
     Crea el dashboard completo de calidad - VERSIÓN LIMPIA SIN DEBUG
     """
-    st.markdown('<h2 class="module-header">⭐ Análisis de Calidad</h2>', unsafe_allow_html=True)
+    st.markdown(MODULE_HEADER_HTML, unsafe_allow_html=True)
     
     if df_quality is None:
         st.warning("⚠️ No se ha cargado el archivo de Calidad")
         st.info("Sube un archivo CSV desde el panel lateral para ver el análisis.")
         return
     
-    # Variables numéricas disponibles
-    numeric_columns = [
-        "lte_rrc_setup_suc", "lte_rrc_attempt", "fails_rrc_setup", "lte_rrc_sr",
-        "init_e_rab_suc_setup", "add_e_rab_suc_setup", "add_e_rab_setup_att", 
-        "init_e_rab_setup_att", "lte_e_rab_sr", "lte_call_drop", 
-        "lte_call_attempt", "lte_cdr"
-    ]
+    # Limpiar datos numéricos y convertir start_time (cacheado por archivo subido)
+    df_clean, date_conversion_success = prepare_quality_data(
+        st.session_state["file_ids"].get("Calidad"), df_quality
+    )
     
-    # Limpiar datos numéricos
-    df_clean = clean_numeric_data(df_quality, numeric_columns)
-    
-    # Convertir start_time
-    df_clean, date_conversion_success = parse_datetime_column(df_clean, "start_time")
+    # Columna de sites (se busca una sola vez por rerun)
+    site_col = find_site_column(df_clean)
     
     # Métricas básicas
     col1, col2, col3, col4 = st.columns(4)
@@ -37,7 +94,6 @@ def create_quality_dashboard(df_quality):
         st.metric("Total Registros", f"{len(df_clean):,}")
     
     with col2:
-        site_col = find_site_column(df_clean)
         if site_col:
             st.metric("Sites Únicos", df_clean[site_col].nunique())
         else:
@@ -55,7 +111,7 @@ def create_quality_dashboard(df_quality):
     
     with col4:
         # Mostrar cantidad de métricas numéricas disponibles
-        available_metrics = [col for col in numeric_columns if col in df_clean.columns]
+        available_metrics = [col for col in NUMERIC_COLUMNS if col in df_clean.columns]
         st.metric("Métricas Disponibles", len(available_metrics))
     
     # === FILTROS PRINCIPALES ===
@@ -65,9 +121,8 @@ def create_quality_dashboard(df_quality):
     
     with filter_col1:
         # Filtro por Sites
-        site_col = find_site_column(df_clean)
         if site_col:
-            all_sites = sorted(df_clean[site_col].unique())
+            all_sites = sorted_unique_values(df_clean[site_col])
             selected_sites = st.multiselect(
                 "🗼 Seleccionar Sites",
                 all_sites,
@@ -81,29 +136,13 @@ def create_quality_dashboard(df_quality):
     
     with filter_col2:
         # Filtro por Métricas
-        available_metrics = [col for col in numeric_columns if col in df_clean.columns]
-        
-        # Crear nombres más amigables para las métricas
-        metric_labels = {
-            "lte_rrc_setup_suc": "📶 RRC Setup Success",
-            "lte_rrc_attempt": "📶 RRC Attempts",
-            "fails_rrc_setup": "❌ RRC Setup Fails",
-            "lte_rrc_sr": "📊 RRC Success Rate (%)",
-            "init_e_rab_suc_setup": "🔗 Initial E-RAB Success",
-            "add_e_rab_suc_setup": "➕ Additional E-RAB Success",
-            "add_e_rab_setup_att": "➕ Additional E-RAB Attempts",
-            "init_e_rab_setup_att": "🔗 Initial E-RAB Attempts",
-            "lte_e_rab_sr": "📊 E-RAB Success Rate (%)",
-            "lte_call_drop": "📞 Call Drops",
-            "lte_call_attempt": "📞 Call Attempts",
-            "lte_cdr": "📉 Call Drop Rate (%)"
-        }
+        available_metrics = [col for col in NUMERIC_COLUMNS if col in df_clean.columns]
         
         selected_metrics = st.multiselect(
             "📊 Seleccionar Métricas",
             available_metrics,
             default=available_metrics[:2] if len(available_metrics) >= 2 else available_metrics,
-            format_func=lambda x: metric_labels.get(x, x),
+            format_func=lambda x: METRIC_LABELS.get(x, x),
             help="Selecciona las métricas de calidad que quieres visualizar",
             key="calidad_metrics_multiselect"
         )
@@ -156,16 +195,18 @@ def create_quality_dashboard(df_quality):
             end_date = None
     
     # === APLICAR FILTROS ===
-    df_filtered = df_clean.copy()
+    df_filtered = df_clean
+    
+    # Filtrar por fechas (el DataFrame viene ordenado por start_time: slice por búsqueda binaria)
+    if date_conversion_success and start_date and end_date:
+        df_filtered = df_filtered.iloc[date_range_slice(df_filtered["start_time"], start_date, end_date)]
     
     # Filtrar por sites
     if selected_sites and site_col:
-        df_filtered = df_filtered[df_filtered[site_col].isin(selected_sites)]
+        df_filtered = df_filtered.iloc[np.flatnonzero(isin_mask(df_filtered[site_col], selected_sites))]
     
-    # Filtrar por fechas
-    if date_conversion_success and start_date and end_date:
-        mask = (df_filtered["start_time"].dt.date >= start_date) & (df_filtered["start_time"].dt.date <= end_date)
-        df_filtered = df_filtered[mask]
+    # Key de los agregados cacheados: el archivo y los filtros determinan df_filtered
+    filter_key = (st.session_state["file_ids"].get("Calidad"), tuple(selected_sites), start_date, end_date)
     
     # Verificar que hay datos después del filtrado
     if len(df_filtered) == 0:
@@ -231,33 +272,27 @@ def create_quality_dashboard(df_quality):
             # Crear gráfico temporal
             fig = go.Figure()
             
-            # Preparar datos
-            plot_data = df_filtered.copy()
-            
-            # Normalizar si está seleccionado
+            # Normalizar si está seleccionado (copia superficial con columnas *_norm)
             if normalize_data:
-                for metric in selected_metrics:
-                    if metric in plot_data.columns:
-                        min_val = plot_data[metric].min()
-                        max_val = plot_data[metric].max()
-                        if max_val != min_val:
-                            plot_data[f"{metric}_norm"] = ((plot_data[metric] - min_val) / (max_val - min_val)) * 100
-                        else:
-                            plot_data[f"{metric}_norm"] = 0
-                selected_metrics_plot = [f"{metric}_norm" for metric in selected_metrics]
+                plot_data, selected_metrics_plot = normalize_metrics(df_filtered, selected_metrics)
             else:
+                plot_data = df_filtered
                 selected_metrics_plot = selected_metrics
             
             # Crear gráfico según el tipo seleccionado
             if chart_type == "Líneas":
+                # Scattergl: los puntos se dibujan con WebGL en el navegador
                 if show_by_site and site_col:
-                    # Gráfico con múltiples sites
+                    # Gráfico con múltiples sites (un único groupby en lugar de un filtro por site)
+                    site_groups = dict(iter(plot_data.groupby(site_col, observed=True, sort=False)))
                     for site in selected_sites:
-                        site_data = plot_data[plot_data[site_col] == site]
+                        site_data = site_groups.get(site)
+                        if site_data is None:
+                            continue
                         for metric in selected_metrics_plot:
                             if metric in site_data.columns:
-                                display_name = f"{metric_labels.get(metric.replace('_norm', ''), metric)} - {site}"
-                                fig.add_trace(go.Scatter(
+                                display_name = f"{METRIC_LABELS_NORM.get(metric, metric)} - {site}"
+                                fig.add_trace(go.Scattergl(
                                     x=site_data["start_time"],
                                     y=site_data[metric],
                                     mode='lines+markers',
@@ -268,8 +303,8 @@ def create_quality_dashboard(df_quality):
                     # Gráfico con múltiples métricas
                     for metric in selected_metrics_plot:
                         if metric in plot_data.columns:
-                            display_name = metric_labels.get(metric.replace('_norm', ''), metric)
-                            fig.add_trace(go.Scatter(
+                            display_name = METRIC_LABELS_NORM.get(metric, metric)
+                            fig.add_trace(go.Scattergl(
                                 x=plot_data["start_time"],
                                 y=plot_data[metric],
                                 mode='lines+markers',
@@ -278,13 +313,19 @@ def create_quality_dashboard(df_quality):
                             ))
             
             elif chart_type == "Barras":
-                # Para barras, agrupar por hora o por intervalo
-                plot_data["hour_bin"] = plot_data["start_time"].dt.floor('H')
-                hourly_data = plot_data.groupby("hour_bin")[selected_metrics_plot].mean().reset_index()
+                # Para barras, promedios por hora con resample sobre el índice temporal (sin columna hour_bin)
+                hourly_data = (
+                    plot_data.set_index("start_time")[selected_metrics_plot]
+                    .resample("1h")
+                    .mean()
+                    .dropna(how="all")
+                    .reset_index()
+                    .rename(columns={"start_time": "hour_bin"})
+                )
                 
                 for metric in selected_metrics_plot:
                     if metric in hourly_data.columns:
-                        display_name = metric_labels.get(metric.replace('_norm', ''), metric)
+                        display_name = METRIC_LABELS_NORM.get(metric, metric)
                         fig.add_trace(go.Bar(
                             x=hourly_data["hour_bin"],
                             y=hourly_data[metric],
@@ -295,7 +336,7 @@ def create_quality_dashboard(df_quality):
             elif chart_type == "Área":
                 for metric in selected_metrics_plot:
                     if metric in plot_data.columns:
-                        display_name = metric_labels.get(metric.replace('_norm', ''), metric)
+                        display_name = METRIC_LABELS_NORM.get(metric, metric)
                         fig.add_trace(go.Scatter(
                             x=plot_data["start_time"],
                             y=plot_data[metric],
@@ -333,19 +374,25 @@ def create_quality_dashboard(df_quality):
     else:
         st.warning("⚠️ No hay datos para mostrar")
     
+    # Promedios por site, calculados junto con los horarios cuando es posible
+    site_averages = None
+    
     # === ANÁLISIS POR HORA DEL DÍA ===
     if date_conversion_success and selected_metrics and len(df_filtered) > 0 and len(selected_sites) > 0:
         st.subheader("🕐 Análisis por Hora del Día")
         
-        # Calcular promedios por hora
-        hourly_data = df_filtered.groupby("hour")[selected_metrics].mean().reset_index()
+        # Calcular promedios por hora (y por site en la misma pasada), cacheados por filtros
+        if site_col:
+            hourly_data, site_averages = site_hour_averages(filter_key, df_filtered, site_col, tuple(selected_metrics))
+        else:
+            hourly_data = grouped_means(filter_key, df_filtered, "hour", tuple(selected_metrics))
         
         # Gráfico de barras por hora
         fig_hourly = go.Figure()
         
         for metric in selected_metrics:
             if metric in hourly_data.columns:
-                display_name = metric_labels.get(metric, metric)
+                display_name = METRIC_LABELS.get(metric, metric)
                 fig_hourly.add_trace(go.Bar(
                     x=hourly_data["hour"],
                     y=hourly_data[metric],
@@ -367,14 +414,15 @@ def create_quality_dashboard(df_quality):
     if len(selected_sites) > 1 and selected_metrics and site_col:
         st.subheader("🏆 Comparación entre Sites")
         
-        # Calcular promedios por site
-        site_averages = df_filtered.groupby(site_col)[selected_metrics].mean().reset_index()
+        # Calcular promedios por site (si no salieron ya del análisis por hora)
+        if site_averages is None:
+            site_averages = grouped_means(filter_key, df_filtered, site_col, tuple(selected_metrics))
         
         # Seleccionar métrica para comparar
         comparison_metric = st.selectbox(
             "Métrica para comparación:",
             selected_metrics,
-            format_func=lambda x: metric_labels.get(x, x),
+            format_func=lambda x: METRIC_LABELS.get(x, x),
             key="calidad_comparison_metric_selectbox"
         )
         
@@ -385,8 +433,8 @@ def create_quality_dashboard(df_quality):
                 x=comparison_metric,
                 y=site_col,
                 orientation='h',
-                title=f"Comparación de {metric_labels.get(comparison_metric, comparison_metric)} entre Sites",
-                labels={'x': metric_labels.get(comparison_metric, comparison_metric), 'y': 'Site'}
+                title=f"Comparación de {METRIC_LABELS.get(comparison_metric, comparison_metric)} entre Sites",
+                labels={'x': METRIC_LABELS.get(comparison_metric, comparison_metric), 'y': 'Site'}
             )
             fig_comparison.update_layout(height=max(400, len(selected_sites) * 30))
             st.plotly_chart(fig_comparison, use_container_width=True)
@@ -395,23 +443,16 @@ def create_quality_dashboard(df_quality):
     if selected_metrics:
         st.subheader("📊 Estadísticas Resumen")
         
-        stats_data = []
-        for metric in selected_metrics:
-            if metric in df_filtered.columns:
-                metric_data = df_filtered[metric].dropna()
-                if len(metric_data) > 0:
-                    stats_data.append({
-                        "Métrica": metric_labels.get(metric, metric),
-                        "Promedio": f"{metric_data.mean():.3f}",
-                        "Mínimo": f"{metric_data.min():.3f}",
-                        "Máximo": f"{metric_data.max():.3f}",
-                        "Desv. Estándar": f"{metric_data.std():.3f}",
-                        "Registros": len(metric_data)
-                    })
+        # Todas las estadísticas de todas las métricas en una sola agregación
+        stats_df = summary_statistics(df_filtered, selected_metrics, METRIC_LABELS)
         
-        if stats_data:
-            stats_df = pd.DataFrame(stats_data)
-            st.dataframe(stats_df, use_container_width=True, hide_index=True)
+        if len(stats_df) > 0:
+            st.dataframe(
+                stats_df,
+                column_config=SUMMARY_STATS_COLUMN_CONFIG,
+                use_container_width=True,
+                hide_index=True
+            )
     
     # === TABLA DE DATOS FILTRADOS ===
     st.subheader("📋 Datos Filtrados")
@@ -441,14 +482,16 @@ def create_quality_dashboard(df_quality):
         display_columns = [col for col in essential_columns if col in df_filtered.columns]
     
     # Mostrar tabla
-    st.dataframe(df_filtered[display_columns].head(max_rows), use_container_width=True, hide_index=True)
+    st.dataframe(df_filtered.iloc[:max_rows].loc[:, display_columns], use_container_width=True, hide_index=True)
     
     # === BOTÓN DE DESCARGA ===
-    csv = df_filtered.to_csv(index=False)
-    st.download_button(
-        label="📥 Descargar datos filtrados (CSV)",
-        data=csv,
-        file_name=f"calidad_filtrado_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-        mime="text/csv",
-        key="calidad_download_filtered"
-    )
\ No newline at end of file
+    # El CSV solo se genera si el usuario lo prepara
+    if st.checkbox("📦 Preparar archivo de descarga", value=False, key="calidad_prepare_download"):
+        csv = dataframe_to_csv_bytes(df_filtered)
+        st.download_button(
+            label="📥 Descargar datos filtrados (CSV)",
+            data=csv,
+            file_name=f"calidad_filtrado_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+            mime="text/csv",
+            key="calidad_download_filtered"
+        )
\ No newline at end of file
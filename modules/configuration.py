@@ -1,13 +1,16 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from utils.helpers import find_site_column
+from utils.helpers import find_site_column, dataframe_to_csv_bytes
+
+# Encabezado del módulo
+MODULE_HEADER_HTML = '<h2 class="module-header">⚙️ Análisis de Configuración</h2>'
 
 def create_configuration_dashboard(df_config):
     """
     Crea el dashboard básico de configuración
     """
-    st.markdown('<h2 class="module-header">⚙️ Análisis de Configuración</h2>', unsafe_allow_html=True)
+    st.markdown(MODULE_HEADER_HTML, unsafe_allow_html=True)
     
     if df_config is None:
         st.warning("⚠️ No se ha cargado el archivo de Configuración")
@@ -65,12 +68,13 @@ def create_configuration_dashboard(df_config):
     # Mostrar datos
     st.dataframe(df_config.head(max_rows), use_container_width=True, hide_index=True)
     
-    # Botón de descarga
-    csv = df_config.to_csv(index=False)
-    st.download_button(
-        label="📥 Descargar datos de configuración (CSV)",
-        data=csv,
-        file_name=f"configuracion_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-        mime="text/csv",
-        key="configuration_download_filtered"
-    )
\ No newline at end of file
+    # Botón de descarga (el CSV solo se genera si el usuario lo pide)
+    if st.checkbox("📦 Preparar archivo de descarga", value=False, key="configuration_prepare_download"):
+        csv = dataframe_to_csv_bytes(df_config)
+        st.download_button(
+            label="📥 Descargar datos de configuración (CSV)",
+            data=csv,
+            file_name=f"configuracion_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+            mime="text/csv",
+            key="configuration_download_filtered"
+        )
\ No newline at end of file
@@ -1,36 +1,337 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-from utils.helpers import find_site_column, clean_numeric_data, parse_datetime_column
+from utils.helpers import find_site_column, clean_numeric_data, parse_datetime_column, date_range_mask, dataframe_to_csv_bytes, isin_mask, site_hour_averages, grouped_means, downsample_timeseries, sorted_unique_values, normalize_metrics, summary_statistics, SUMMARY_STATS_COLUMN_CONFIG
+from utils.data_loader import LOADED_FILES_CACHE_ENTRIES
+
+# Encabezado del módulo
+MODULE_HEADER_HTML = '<h2 class="module-header">🚀 Análisis de Desempeño</h2>'
+
+# Variables numéricas disponibles
+NUMERIC_COLUMNS = [
+    "dl_data_traffic_mb", "ul_data_traffic_mb", "enodeb_dl_tgput_mb",
+    "lte_dl_cell_tgput_mb", "lte_ul_cell_tgput_mb", "lte_tu_prb_dl",
+    "average_number_user", "enodeb_ul_tgput_mb", "latency", 
+    "tcp_pckt_loss_ratio", "voice_traffic"
+]
+
+# Nombres amigables de las métricas
+METRIC_LABELS = {
+    "dl_data_traffic_mb": "📥 Tráfico DL (MB)",
+    "ul_data_traffic_mb": "📤 Tráfico UL (MB)", 
+    "enodeb_dl_tgput_mb": "🚀 eNodeB DL Throughput (MB)",
+    "lte_dl_cell_tgput_mb": "📶 LTE DL Cell Throughput (MB)",
+    "lte_ul_cell_tgput_mb": "📶 LTE UL Cell Throughput (MB)",
+    "lte_tu_prb_dl": "📡 PRB DL Utilization (%)",
+    "average_number_user": "👥 Usuarios Promedio",
+    "enodeb_ul_tgput_mb": "🚀 eNodeB UL Throughput (MB)",
+    "latency": "⚡ Latencia (ms)",
+    "tcp_pckt_loss_ratio": "📉 TCP Packet Loss Ratio",
+    "voice_traffic": "📞 Tráfico de Voz"
+}
+
+# Mismos nombres indexados también por las columnas normalizadas (*_norm)
+METRIC_LABELS_NORM = {**METRIC_LABELS, **{f"{metric}_norm": label for metric, label in METRIC_LABELS.items()}}
+
+@st.cache_data(show_spinner=False, max_entries=LOADED_FILES_CACHE_ENTRIES)
+def prepare_performance_data(file_id, _df_performance):
+    """
+    Limpia numéricos y parsea fechas una sola vez por archivo subido
+    
+    Args:
+        file_id: Identificador del archivo subido (key de caché)
+        _df_performance: DataFrame de desempeño (no se hashea)
+        
+    Returns:
+        Tuple: (DataFrame procesado, éxito del parseo de start_time, sites ordenados)
+    """
+    df_clean = clean_numeric_data(_df_performance, NUMERIC_COLUMNS)
+    
+    # Sites como category (isin, nunique y groupby sobre códigos enteros)
+    site_col = find_site_column(df_clean)
+    if site_col:
+        df_clean[site_col] = df_clean[site_col].astype("category")
+    
+    # Convertir start_time y end_time
+    df_clean, date_conversion_success = parse_datetime_column(df_clean, "start_time")
+    df_clean, _ = parse_datetime_column(df_clean, "end_time", create_derived_fields=False)
+    
+    # Hora como int8 (se agrupa por ella en cada rerun); con NaT se deja como float
+    if "hour" in df_clean.columns and df_clean["hour"].notna().all():
+        df_clean["hour"] = df_clean["hour"].astype("int8")
+    
+    # Lista ordenada de sites para el selector (se ordena una sola vez por archivo)
+    all_sites = sorted_unique_values(df_clean[site_col]) if site_col else []
+    
+    return df_clean, date_conversion_success, all_sites
+
+@st.fragment
+def _timeline_section(df_filtered, selected_sites, selected_metrics, site_col, date_conversion_success):
+    """
+    Gráfico principal con sus opciones de visualización
+    
+    Al ser un fragment, cambiar el tipo de gráfico o la normalización solo vuelve a
+    ejecutar esta sección, no el filtrado ni el resto del dashboard.
+    """
+    st.subheader("📊 Gráfico Principal - Timeline de Métricas")
+    
+    # Opciones de visualización
+    viz_col1, viz_col2, viz_col3 = st.columns(3)
+    
+    with viz_col1:
+        chart_type = st.radio(
+            "Tipo de Gráfico",
+            ["Líneas", "Barras", "Área"],
+            horizontal=True
+        )
+    
+    with viz_col2:
+        if len(selected_sites) > 1:
+            show_by_site = st.checkbox("Separar por Site", value=True, key="desempeño_show_by_site")
+        else:
+            show_by_site = False
+    
+    with viz_col3:
+        normalize_data = st.checkbox("Normalizar datos (0-100%)", help="Útil para comparar métricas con diferentes escalas", key="desempeño_normalize_data")
+    
+    # Preparar datos para el gráfico
+    if date_conversion_success:
+        # Crear gráfico temporal
+        fig = go.Figure()
+        
+        # Normalizar si está seleccionado (copia superficial con columnas *_norm)
+        if normalize_data:
+            plot_data, selected_metrics_plot = normalize_metrics(df_filtered, selected_metrics)
+        else:
+            plot_data = df_filtered
+            selected_metrics_plot = selected_metrics
+        
+        # Métricas presentes (las series largas se reducen antes de enviarlas a Plotly)
+        metrics_in_plot = [metric for metric in selected_metrics_plot if metric in plot_data.columns]
+        
+        # Crear gráfico según el tipo seleccionado
+        if chart_type == "Líneas":
+            # Scattergl: los puntos se dibujan con WebGL en el navegador
+            if show_by_site and site_col:
+                # Gráfico con múltiples sites: cada serie se reduce por site y todas se
+                # dibujan con un único px.line en formato largo (color = site, trazo = métrica)
+                site_series = {
+                    site: downsample_timeseries(site_data, "start_time", metrics_in_plot)[["start_time"] + metrics_in_plot]
+                    for site, site_data in plot_data.groupby(site_col, observed=True, sort=False)
+                }
+                line_data = pd.concat(site_series, names=[site_col, None]).reset_index(level=0)
+                melted = line_data.melt(id_vars=["start_time", site_col], var_name="metric")
+                melted["metric"] = melted["metric"].map(
+                    {metric: METRIC_LABELS_NORM.get(metric, metric) for metric in metrics_in_plot}
+                )
+                fig = px.line(
+                    melted,
+                    x="start_time",
+                    y="value",
+                    color=site_col,
+                    line_dash="metric",
+                    markers=True,
+                    render_mode="webgl",
+                    category_orders={site_col: selected_sites},
+                    labels={site_col: "Site", "metric": "Métrica"}
+                )
+            else:
+                # Gráfico con múltiples métricas
+                line_data = downsample_timeseries(plot_data, "start_time", metrics_in_plot)
+                for metric in selected_metrics_plot:
+                    if metric in line_data.columns:
+                        display_name = METRIC_LABELS_NORM.get(metric, metric)
+                        fig.add_trace(go.Scattergl(
+                            x=line_data["start_time"],
+                            y=line_data[metric],
+                            mode='lines+markers',
+                            name=display_name,
+                            line=dict(width=2)
+                        ))
+        
+        elif chart_type == "Barras":
+            # Para barras, promedios por hora con resample sobre el índice temporal (sin columna hour_bin)
+            hourly_data = (
+                plot_data.set_index("start_time")[selected_metrics_plot]
+                .resample("1h")
+                .mean()
+                .dropna(how="all")
+                .reset_index()
+                .rename(columns={"start_time": "hour_bin"})
+            )
+            
+            for metric in selected_metrics_plot:
+                if metric in hourly_data.columns:
+                    display_name = METRIC_LABELS_NORM.get(metric, metric)
+                    fig.add_trace(go.Bar(
+                        x=hourly_data["hour_bin"],
+                        y=hourly_data[metric],
+                        name=display_name,
+                        opacity=0.7
+                    ))
+        
+        elif chart_type == "Área":
+            area_data = downsample_timeseries(plot_data, "start_time", metrics_in_plot)
+            for metric in selected_metrics_plot:
+                if metric in area_data.columns:
+                    display_name = METRIC_LABELS_NORM.get(metric, metric)
+                    fig.add_trace(go.Scatter(
+                        x=area_data["start_time"],
+                        y=area_data[metric],
+                        mode='lines',
+                        name=display_name,
+                        fill='tonexty' if metric != selected_metrics_plot[0] else 'tozeroy',
+                        line=dict(width=0)
+                    ))
+        
+        # Configurar layout
+        fig.update_layout(
+            title=f"Timeline de Métricas - {', '.join(selected_sites) if len(selected_sites) <= 3 else f'{len(selected_sites)} sites'}",
+            xaxis_title="Tiempo",
+            yaxis_title="Valores" + (" (Normalizados 0-100%)" if normalize_data else ""),
+            hovermode='x unified',
+            height=500,
+            showlegend=True,
+            legend=dict(
+                yanchor="top",
+                y=0.99,
+                xanchor="left",
+                x=1.01
+            )
+        )
+        
+        st.plotly_chart(fig, use_container_width=True)
+    
+    else:
+        st.error("❌ No se pueden crear gráficos temporales sin fechas válidas")
+
+@st.fragment
+def _hourly_section(filter_key, df_filtered, selected_metrics, site_col):
+    """Promedios por hora del día de las métricas seleccionadas"""
+    st.subheader("🕐 Análisis por Hora del Día")
+    
+    # Calcular promedios por hora (y por site en la misma pasada), cacheados por filtros
+    if site_col:
+        hourly_data, _ = site_hour_averages(filter_key, df_filtered, site_col, tuple(selected_metrics))
+    else:
+        hourly_data = grouped_means(filter_key, df_filtered, "hour", tuple(selected_metrics))
+    
+    # Gráfico de barras por hora
+    fig_hourly = go.Figure()
+    
+    for metric in selected_metrics:
+        if metric in hourly_data.columns:
+            display_name = METRIC_LABELS.get(metric, metric)
+            fig_hourly.add_trace(go.Bar(
+                x=hourly_data["hour"],
+                y=hourly_data[metric],
+                name=display_name,
+                opacity=0.8
+            ))
+    
+    fig_hourly.update_layout(
+        title="Promedios por Hora del Día",
+        xaxis_title="Hora",
+        yaxis_title="Valor Promedio",
+        height=400,
+        showlegend=True
+    )
+    
+    st.plotly_chart(fig_hourly, use_container_width=True)
+
+@st.fragment
+def _comparison_section(filter_key, df_filtered, selected_sites, selected_metrics, site_col, date_conversion_success):
+    """Comparación de una métrica entre los sites seleccionados"""
+    st.subheader("🏆 Comparación entre Sites")
+    
+    # Promedios por site: salen del mismo cálculo cacheado que el análisis por hora
+    if date_conversion_success:
+        _, site_averages = site_hour_averages(filter_key, df_filtered, site_col, tuple(selected_metrics))
+    else:
+        site_averages = grouped_means(filter_key, df_filtered, site_col, tuple(selected_metrics))
+    
+    # Seleccionar métrica para comparar
+    comparison_metric = st.selectbox(
+        "Métrica para comparación:",
+        selected_metrics,
+        format_func=lambda x: METRIC_LABELS.get(x, x),
+        key="desempeño_comparison_metric"
+    )
+    
+    if comparison_metric in site_averages.columns:
+        # Gráfico de barras horizontal
+        fig_comparison = px.bar(
+            site_averages,
+            x=comparison_metric,
+            y=site_col,
+            orientation='h',
+            title=f"Comparación de {METRIC_LABELS.get(comparison_metric, comparison_metric)} entre Sites",
+            labels={'x': METRIC_LABELS.get(comparison_metric, comparison_metric), 'y': 'Site'}
+        )
+        fig_comparison.update_layout(height=max(400, len(selected_sites) * 30))
+        st.plotly_chart(fig_comparison, use_container_width=True)
+
+@st.fragment
+def _table_section(df_filtered, selected_metrics, site_col):
+    """Tabla de datos filtrados con sus controles y la descarga en CSV"""
+    st.subheader("📋 Datos filtrados")
+    
+    # Controles de tabla
+    table_col1, table_col2 = st.columns(2)
+    
+    with table_col1:
+        max_rows = st.slider("Número de filas a mostrar:", 10, 500, 100, key="desempeño_rows")
+    
+    with table_col2:
+        show_all_columns = st.checkbox("Mostrar todas las columnas", value=False, key="desempeño_show_all_columns")
+    
+    # Preparar columnas para mostrar
+    if show_all_columns:
+        display_columns = list(df_filtered.columns)
+    else:
+        # Mostrar columnas esenciales
+        essential_columns = ["start_time", "end_time"]
+        if site_col:
+            essential_columns.append(site_col)
+        essential_columns.extend(selected_metrics)
+        display_columns = [col for col in essential_columns if col in df_filtered.columns]
+    
+    # Mostrar datos
+    st.dataframe(df_filtered.iloc[:max_rows].loc[:, display_columns], use_container_width=True, hide_index=True)
+    
+    # Botón de descarga (el CSV solo se genera si el usuario lo prepara)
+    if st.checkbox("📦 Preparar archivo de descarga", value=False, key="desempeño_prepare_download"):
+        csv = dataframe_to_csv_bytes(df_filtered)
+        st.download_button(
+            label="📥 Descargar datos filtrados (CSV)",
+            data=csv,
+            file_name=f"desempeño_filtrado_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+            mime="text/csv",
+            key="desempeño_download_filtered"
+        )
 
 def create_performance_dashboard(df_performance):
     """
     Crea el dashboard completo de desempeño
     """
-    st.markdown('<h2 class="module-header">🚀 Análisis de Desempeño</h2>', unsafe_allow_html=True)
+    st.markdown(MODULE_HEADER_HTML, unsafe_allow_html=True)
     
     if df_performance is None:
         st.warning("⚠️ No se ha cargado el archivo de Desempeño")
         st.info("Sube un archivo CSV desde el panel lateral para ver el análisis.")
         return
     
-    # Variables numéricas disponibles
-    numeric_columns = [
-        "dl_data_traffic_mb", "ul_data_traffic_mb", "enodeb_dl_tgput_mb",
-        "lte_dl_cell_tgput_mb", "lte_ul_cell_tgput_mb", "lte_tu_prb_dl",
-        "average_number_user", "enodeb_ul_tgput_mb", "latency", 
-        "tcp_pckt_loss_ratio", "voice_traffic"
-    ]
+    # Limpiar datos numéricos y convertir fechas (cacheado por archivo subido)
+    df_clean, date_conversion_success, all_sites = prepare_performance_data(
+        st.session_state["file_ids"].get("Desempeño"), df_performance
+    )
+    
+    # Columna de sites (se busca una sola vez por rerun)
+    site_col = find_site_column(df_clean)
     
-    # Limpiar datos numéricos
-    df_clean = clean_numeric_data(df_performance, numeric_columns)
-
-    # Convertir start_time y end_time
-    df_clean, date_conversion_success = parse_datetime_column(df_clean, "start_time")
-    df_clean, _ = parse_datetime_column(df_clean, "end_time", create_derived_fields=False)
-       
     # Métricas básicas
     col1, col2, col3, col4 = st.columns(4)
     
@@ -38,7 +339,6 @@ def create_performance_dashboard(df_performance):
         st.metric("Total Registros", f"{len(df_clean):,}")
     
     with col2:
-        site_col = find_site_column(df_clean)
         if site_col:
             st.metric("Sites Únicos", df_clean[site_col].nunique())
         else:
@@ -56,7 +356,7 @@ def create_performance_dashboard(df_performance):
     
     with col4:
         # Mostrar cantidad de métricas numéricas disponibles
-        available_metrics = [col for col in numeric_columns if col in df_clean.columns]
+        available_metrics = [col for col in NUMERIC_COLUMNS if col in df_clean.columns]
         st.metric("Métricas Disponibles", len(available_metrics))
     
     # === FILTROS PRINCIPALES ===
@@ -66,9 +366,7 @@ def create_performance_dashboard(df_performance):
     
     with filter_col1:
         # Filtro por Site
-        site_col = find_site_column(df_clean)
         if site_col:
-            all_sites = sorted(df_clean[site_col].unique())
             selected_sites = st.multiselect(
                 "🗼 Seleccionar Sites",
                 all_sites,
@@ -82,28 +380,13 @@ def create_performance_dashboard(df_performance):
     
     with filter_col2:
         # Filtro por Métricas
-        available_metrics = [col for col in numeric_columns if col in df_clean.columns]
-        
-        # Crear nombres más amigables para las métricas
-        metric_labels = {
-            "dl_data_traffic_mb": "📥 Tráfico DL (MB)",
-            "ul_data_traffic_mb": "📤 Tráfico UL (MB)", 
-            "enodeb_dl_tgput_mb": "🚀 eNodeB DL Throughput (MB)",
-            "lte_dl_cell_tgput_mb": "📶 LTE DL Cell Throughput (MB)",
-            "lte_ul_cell_tgput_mb": "📶 LTE UL Cell Throughput (MB)",
-            "lte_tu_prb_dl": "📡 PRB DL Utilization (%)",
-            "average_number_user": "👥 Usuarios Promedio",
-            "enodeb_ul_tgput_mb": "🚀 eNodeB UL Throughput (MB)",
-            "latency": "⚡ Latencia (ms)",
-            "tcp_pckt_loss_ratio": "📉 TCP Packet Loss Ratio",
-            "voice_traffic": "📞 Tráfico de Voz"
-        }
+        available_metrics = [col for col in NUMERIC_COLUMNS if col in df_clean.columns]
         
         selected_metrics = st.multiselect(
             "📊 Seleccionar Métricas",
             available_metrics,
             default=available_metrics[:2] if len(available_metrics) >= 2 else available_metrics,
-            format_func=lambda x: metric_labels.get(x, x),
+            format_func=lambda x: METRIC_LABELS.get(x, x),
             help="Selecciona las métricas que quieres visualizar",
             key="desempeño_metrics"
         )
@@ -144,16 +427,21 @@ def create_performance_dashboard(df_performance):
             end_date = None
     
     # === APLICAR FILTROS ===
-    df_filtered = df_clean.copy()
+    # Una sola máscara combinada (sites y fechas) y un único slice del DataFrame
+    mask = np.ones(len(df_clean), dtype=bool)
     
     # Filtrar por sites
     if selected_sites and site_col:
-        df_filtered = df_filtered[df_filtered[site_col].isin(selected_sites)]
+        mask &= isin_mask(df_clean[site_col], selected_sites)
     
     # Filtrar por fechas
     if date_conversion_success and start_date and end_date:
-        mask = (df_filtered["start_time"].dt.date >= start_date) & (df_filtered["start_time"].dt.date <= end_date)
-        df_filtered = df_filtered[mask]
+        mask &= date_range_mask(df_clean["start_time"], start_date, end_date)
+    
+    df_filtered = df_clean.iloc[np.flatnonzero(mask)]
+    
+    # Key de los agregados cacheados: el archivo y los filtros determinan df_filtered
+    filter_key = (st.session_state["file_ids"].get("Desempeño"), tuple(selected_sites), start_date, end_date)
     
     # Verificar que hay datos después del filtrado
     if len(df_filtered) == 0:
@@ -181,240 +469,32 @@ def create_performance_dashboard(df_performance):
             st.metric("Días Analizados", days_selected)
     
     # === GRÁFICO PRINCIPAL ===
-    if selected_metrics and len(df_filtered) > 0:
-        st.subheader("📊 Gráfico Principal - Timeline de Métricas")
-        
-        # Opciones de visualización
-        viz_col1, viz_col2, viz_col3 = st.columns(3)
-        
-        with viz_col1:
-            chart_type = st.radio(
-                "Tipo de Gráfico",
-                ["Líneas", "Barras", "Área"],
-                horizontal=True
-            )
-        
-        with viz_col2:
-            if len(selected_sites) > 1:
-                show_by_site = st.checkbox("Separar por Site", value=True, key="desempeño_show_by_site")
-            else:
-                show_by_site = False
-        
-        with viz_col3:
-            normalize_data = st.checkbox("Normalizar datos (0-100%)", help="Útil para comparar métricas con diferentes escalas", key="desempeño_normalize_data")
-        
-        # Preparar datos para el gráfico
-        if date_conversion_success:
-            # Crear gráfico temporal
-            fig = go.Figure()
-            
-            # Preparar datos
-            plot_data = df_filtered.copy()
-            
-            # Normalizar si está seleccionado
-            if normalize_data:
-                for metric in selected_metrics:
-                    if metric in plot_data.columns:
-                        min_val = plot_data[metric].min()
-                        max_val = plot_data[metric].max()
-                        if max_val != min_val:
-                            plot_data[f"{metric}_norm"] = ((plot_data[metric] - min_val) / (max_val - min_val)) * 100
-                        else:
-                            plot_data[f"{metric}_norm"] = 0
-                selected_metrics_plot = [f"{metric}_norm" for metric in selected_metrics]  # MOVER ESTA LÍNEA AQUÍ
-            else:
-                selected_metrics_plot = selected_metrics
-            
-            # Crear gráfico según el tipo seleccionado
-            if chart_type == "Líneas":
-                if show_by_site and site_col:
-                    # Gráfico con múltiples sites
-                    for site in selected_sites:
-                        site_data = plot_data[plot_data[site_col] == site]
-                        for metric in selected_metrics_plot:
-                            if metric in site_data.columns:
-                                display_name = f"{metric_labels.get(metric.replace('_norm', ''), metric)} - {site}"
-                                fig.add_trace(go.Scatter(
-                                    x=site_data["start_time"],
-                                    y=site_data[metric],
-                                    mode='lines+markers',
-                                    name=display_name,
-                                    line=dict(width=2)
-                                ))
-                else:
-                    # Gráfico con múltiples métricas
-                    for metric in selected_metrics_plot:
-                        if metric in plot_data.columns:
-                            display_name = metric_labels.get(metric.replace('_norm', ''), metric)
-                            fig.add_trace(go.Scatter(
-                                x=plot_data["start_time"],
-                                y=plot_data[metric],
-                                mode='lines+markers',
-                                name=display_name,
-                                line=dict(width=2)
-                            ))
-            
-            elif chart_type == "Barras":
-                # Para barras, agrupar por hora o por intervalo
-                plot_data["hour_bin"] = plot_data["start_time"].dt.floor('H')
-                hourly_data = plot_data.groupby("hour_bin")[selected_metrics_plot].mean().reset_index()
-                
-                for metric in selected_metrics_plot:
-                    if metric in hourly_data.columns:
-                        display_name = metric_labels.get(metric.replace('_norm', ''), metric)
-                        fig.add_trace(go.Bar(
-                            x=hourly_data["hour_bin"],
-                            y=hourly_data[metric],
-                            name=display_name,
-                            opacity=0.7
-                        ))
-            
-            elif chart_type == "Área":
-                for metric in selected_metrics_plot:
-                    if metric in plot_data.columns:
-                        display_name = metric_labels.get(metric.replace('_norm', ''), metric)
-                        fig.add_trace(go.Scatter(
-                            x=plot_data["start_time"],
-                            y=plot_data[metric],
-                            mode='lines',
-                            name=display_name,
-                            fill='tonexty' if metric != selected_metrics_plot[0] else 'tozeroy',
-                            line=dict(width=0)
-                        ))
-            
-            # Configurar layout
-            fig.update_layout(
-                title=f"Timeline de Métricas - {', '.join(selected_sites) if len(selected_sites) <= 3 else f'{len(selected_sites)} sites'}",
-                xaxis_title="Tiempo",
-                yaxis_title="Valores" + (" (Normalizados 0-100%)" if normalize_data else ""),
-                hovermode='x unified',
-                height=500,
-                showlegend=True,
-                legend=dict(
-                    yanchor="top",
-                    y=0.99,
-                    xanchor="left",
-                    x=1.01
-                )
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
-        
-        else:
-            st.error("❌ No se pueden crear gráficos temporales sin fechas válidas")
+    # Cada sección es un fragment: sus widgets solo vuelven a ejecutar esa sección
+    if selected_metrics:
+        _timeline_section(df_filtered, selected_sites, selected_metrics, site_col, date_conversion_success)
     
     # === ANÁLISIS POR HORA DEL DÍA ===
     if date_conversion_success and selected_metrics:
-        st.subheader("🕐 Análisis por Hora del Día")
-        
-        # Calcular promedios por hora
-        hourly_data = df_filtered.groupby("hour")[selected_metrics].mean().reset_index()
-        
-        # Gráfico de barras por hora
-        fig_hourly = go.Figure()
-        
-        for metric in selected_metrics:
-            if metric in hourly_data.columns:
-                display_name = metric_labels.get(metric, metric)
-                fig_hourly.add_trace(go.Bar(
-                    x=hourly_data["hour"],
-                    y=hourly_data[metric],
-                    name=display_name,
-                    opacity=0.8
-                ))
-        
-        fig_hourly.update_layout(
-            title="Promedios por Hora del Día",
-            xaxis_title="Hora",
-            yaxis_title="Valor Promedio",
-            height=400,
-            showlegend=True
-        )
-        
-        st.plotly_chart(fig_hourly, use_container_width=True)
+        _hourly_section(filter_key, df_filtered, selected_metrics, site_col)
     
     # === COMPARACIÓN ENTRE SITES ===
     if len(selected_sites) > 1 and selected_metrics and site_col:
-        st.subheader("🏆 Comparación entre Sites")
-        
-        # Calcular promedios por site
-        site_averages = df_filtered.groupby(site_col)[selected_metrics].mean().reset_index()
-        
-        # Seleccionar métrica para comparar
-        comparison_metric = st.selectbox(
-            "Métrica para comparación:",
-            selected_metrics,
-            format_func=lambda x: metric_labels.get(x, x),
-            key="desempeño_comparison_metric"
-        )
-        
-        if comparison_metric in site_averages.columns:
-            # Gráfico de barras horizontal
-            fig_comparison = px.bar(
-                site_averages,
-                x=comparison_metric,
-                y=site_col,
-                orientation='h',
-                title=f"Comparación de {metric_labels.get(comparison_metric, comparison_metric)} entre Sites",
-                labels={'x': metric_labels.get(comparison_metric, comparison_metric), 'y': 'Site'}
-            )
-            fig_comparison.update_layout(height=max(400, len(selected_sites) * 30))
-            st.plotly_chart(fig_comparison, use_container_width=True)
+        _comparison_section(filter_key, df_filtered, selected_sites, selected_metrics, site_col, date_conversion_success)
     
     # === ESTADÍSTICAS RESUMEN ===
     if selected_metrics:
         st.subheader("📊 Estadísticas Resumen")
         
-        stats_data = []
-        for metric in selected_metrics:
-            if metric in df_filtered.columns:
-                metric_data = df_filtered[metric].dropna()
-                if len(metric_data) > 0:
-                    stats_data.append({
-                        "Métrica": metric_labels.get(metric, metric),
-                        "Promedio": f"{metric_data.mean():.3f}",
-                        "Mínimo": f"{metric_data.min():.3f}",
-                        "Máximo": f"{metric_data.max():.3f}",
-                        "Desv. Estándar": f"{metric_data.std():.3f}",
-                        "Registros": len(metric_data)
-                    })
+        # Todas las estadísticas de todas las métricas en una sola agregación
+        stats_df = summary_statistics(df_filtered, selected_metrics, METRIC_LABELS)
         
-        if stats_data:
-            stats_df = pd.DataFrame(stats_data)
-            st.dataframe(stats_df, use_container_width=True, hide_index=True)
+        if len(stats_df) > 0:
+            st.dataframe(
+                stats_df,
+                column_config=SUMMARY_STATS_COLUMN_CONFIG,
+                use_container_width=True,
+                hide_index=True
+            )
     
     # === TABLA DE DATOS FILTRADOS ===
-    st.subheader("📋 Datos filtrados")
-    
-    # Controles de tabla
-    table_col1, table_col2 = st.columns(2)
-    
-    with table_col1:
-        max_rows = st.slider("Número de filas a mostrar:", 10, 500, 100, key="desempeño_rows")
-    
-    with table_col2:
-        show_all_columns = st.checkbox("Mostrar todas las columnas", value=False, key="desempeño_show_all_columns")
-    
-    # Preparar columnas para mostrar
-    if show_all_columns:
-        display_columns = list(df_filtered.columns)
-    else:
-        # Mostrar columnas esenciales
-        essential_columns = ["start_time", "end_time"]
-        if site_col:
-            essential_columns.append(site_col)
-        essential_columns.extend(selected_metrics)
-        display_columns = [col for col in essential_columns if col in df_filtered.columns]
-    
-    # Mostrar datos
-    st.dataframe(df_filtered[display_columns].head(max_rows), use_container_width=True, hide_index=True)
-    
-    # Botón de descarga
-    csv = df_filtered.to_csv(index=False)
-    st.download_button(
-        label="📥 Descargar datos filtrados (CSV)",
-        data=csv,
-        file_name=f"desempeño_filtrado_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-        mime="text/csv",
-        key="desempeño_download_filtered"
-    )
\ No newline at end of file
+    _table_section(df_filtered, selected_metrics, site_col)
@@ -3,27 +3,68 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-from utils.helpers import find_site_column, clean_numeric_data, parse_datetime_column
+from utils.helpers import find_site_column, clean_numeric_data, parse_datetime_column, dataframe_to_csv_bytes, isin_mask, downsample_timeseries, sorted_unique_values
+from utils.data_loader import LOADED_FILES_CACHE_ENTRIES
+
+# Encabezado del módulo
+MODULE_HEADER_HTML = '<h2 class="module-header">🟢 Análisis de Disponibilidad</h2>'
+
+# Variables numéricas disponibles
+NUMERIC_COLUMNS = ["cell_serv_time"]
+
+@st.cache_data(show_spinner=False, max_entries=LOADED_FILES_CACHE_ENTRIES)
+def prepare_availability_data(file_id, _df_availability):
+    """
+    Limpia numéricos y parsea fechas una sola vez por archivo subido
+    
+    Args:
+        file_id: Identificador del archivo subido (key de caché)
+        _df_availability: DataFrame de disponibilidad (no se hashea)
+        
+    Returns:
+        Tuple: (DataFrame procesado, éxito del parseo de start_time, sites ordenados)
+    """
+    # Limpiar datos numéricos y parsear fechas usando utilidades centralizadas
+    df_clean = clean_numeric_data(_df_availability, NUMERIC_COLUMNS)
+    
+    # Sites como category (isin, nunique y groupby sobre códigos enteros)
+    site_col = find_site_column(df_clean)
+    if site_col:
+        df_clean[site_col] = df_clean[site_col].astype("category")
+    
+    df_clean, date_conversion_success = parse_datetime_column(df_clean, "start_time")
+    
+    # Orden cronológico una sola vez: los filtros conservan el orden y el timeline no reordena
+    if date_conversion_success:
+        df_clean = df_clean.sort_values("start_time", kind="stable").reset_index(drop=True)
+    
+    # Hora como int8 (se agrupa por ella en cada rerun); con NaT se deja como float
+    if "hour" in df_clean.columns and df_clean["hour"].notna().all():
+        df_clean["hour"] = df_clean["hour"].astype("int8")
+    
+    # Lista ordenada de sites para el selector (se ordena una sola vez por archivo)
+    all_sites = sorted_unique_values(df_clean[site_col]) if site_col else []
+    
+    return df_clean, date_conversion_success, all_sites
 
 def create_availability_dashboard(df_availability):
     """
     Crea el dashboard completo de disponibilidad - VERSIÓN MEJORADA
     """
-    st.markdown('<h2 class="module-header">🟢 Análisis de Disponibilidad</h2>', unsafe_allow_html=True)
+    st.markdown(MODULE_HEADER_HTML, unsafe_allow_html=True)
     
     if df_availability is None:
         st.warning("⚠️ No se ha cargado el archivo de Disponibilidad")
         st.info("Sube un archivo CSV desde el panel lateral para ver el análisis.")
         return
     
-    # Variables numéricas disponibles
-    numeric_columns = ["cell_serv_time"]
+    # Limpiar datos numéricos y parsear fechas (cacheado por archivo subido)
+    df_clean, date_conversion_success, all_sites = prepare_availability_data(
+        st.session_state["file_ids"].get("Disponibilidad"), df_availability
+    )
     
-    # Limpiar datos numéricos usando utilidad centralizada
-    df_clean = clean_numeric_data(df_availability, numeric_columns)
-    
-    # Parsear fechas usando utilidad centralizada
-    df_clean, date_conversion_success = parse_datetime_column(df_clean, "start_time")
+    # Columna de sites (se busca una sola vez por rerun)
+    site_col = find_site_column(df_clean)
     
     # Métricas básicas
     col1, col2, col3, col4 = st.columns(4)
@@ -32,7 +73,6 @@ def create_availability_dashboard(df_availability):
         st.metric("Total Registros", f"{len(df_clean):,}")
     
     with col2:
-        site_col = find_site_column(df_clean)
         if site_col:
             st.metric("Sites Únicos", df_clean[site_col].nunique())
         else:
@@ -64,9 +104,7 @@ def create_availability_dashboard(df_availability):
     st.subheader("🎛️ Filtros de Análisis")
     
     # FILTRO POR MÚLTIPLES SITES
-    site_col = find_site_column(df_clean)
     if site_col:
-        all_sites = sorted(df_clean[site_col].unique())
         selected_sites = st.multiselect(
             "🗼 Seleccionar Sites",
             all_sites,
@@ -79,11 +117,12 @@ def create_availability_dashboard(df_availability):
         st.error("No se encontró columna de sites")
     
     # === APLICAR FILTROS ===
-    df_filtered = df_clean.copy()
+    # Sin copia: el filtro por sites ya crea un DataFrame nuevo
+    df_filtered = df_clean
     
     # Filtrar por sites
     if selected_sites and site_col:
-        df_filtered = df_filtered[df_filtered[site_col].isin(selected_sites)]
+        df_filtered = df_filtered[isin_mask(df_filtered[site_col], selected_sites)]
     
     # Verificar que hay datos después del filtrado
     if len(df_filtered) == 0:
@@ -118,8 +157,9 @@ def create_availability_dashboard(df_availability):
         
         # Preparar datos para el gráfico
         if date_conversion_success:
-            # Preparar datos - usar la nueva columna de datetime
-            plot_data = df_filtered.copy().sort_values('start_time')
+            # Preparar datos (ya ordenados por tiempo en la preparación; copia superficial
+            # porque solo se agrega la columna en horas)
+            plot_data = df_filtered.copy(deep=False)
             
             # Convertir a horas si está seleccionado
             if convert_to_hours:
@@ -133,11 +173,14 @@ def create_availability_dashboard(df_availability):
             # Crear gráfico con múltiples sites
             fig = go.Figure()
             
-            # Agregar línea para cada site
+            # Un único groupby en lugar de un filtro por site (los grupos conservan el orden por tiempo)
+            site_groups = dict(iter(plot_data.groupby(site_col, observed=True, sort=False)))
+            
+            # Agregar línea para cada site (Scattergl: dibujo con WebGL en el navegador)
             for site in selected_sites:
-                site_data = plot_data[plot_data[site_col] == site].sort_values('start_time')
-                if len(site_data) > 0:
-                    fig.add_trace(go.Scatter(
+                if site in site_groups:
+                    site_data = downsample_timeseries(site_groups[site], "start_time", [y_column])
+                    fig.add_trace(go.Scattergl(
                         x=site_data["start_time"],
                         y=site_data[y_column],
                         mode='lines+markers',
@@ -212,24 +255,20 @@ def create_availability_dashboard(df_availability):
     if "cell_serv_time" in df_filtered.columns and len(df_filtered) > 0 and len(selected_sites) > 0:
         st.subheader("📊 Estadísticas Resumen")
         
-        service_time_data = df_filtered["cell_serv_time"].dropna()
-        if len(service_time_data) > 0:
+        # Conteo, promedio, mínimo y máximo en una sola agregación (sin copia dropna)
+        service_time_stats = df_filtered["cell_serv_time"].agg(["count", "mean", "min", "max"])
+        if service_time_stats["count"] > 0:
+            avg_hours, min_hours, max_hours = service_time_stats[["mean", "min", "max"]] / 3600
             
             stats_col1, stats_col2, stats_col3, stats_col4 = st.columns(4)
             
             with stats_col1:
-                avg_seconds = service_time_data.mean()
-                avg_hours = avg_seconds / 3600
                 st.metric("⏱️ Promedio", f"{avg_hours:.2f}h")
             
             with stats_col2:
-                min_seconds = service_time_data.min()
-                min_hours = min_seconds / 3600
                 st.metric("📉 Mínimo", f"{min_hours:.2f}h")
             
             with stats_col3:
-                max_seconds = service_time_data.max()
-                max_hours = max_seconds / 3600
                 st.metric("📈 Máximo", f"{max_hours:.2f}h")
             
             with stats_col4:
@@ -265,14 +304,16 @@ def create_availability_dashboard(df_availability):
         display_columns = [col for col in essential_columns if col in df_filtered.columns]
     
     # Mostrar tabla
-    st.dataframe(df_filtered[display_columns].head(max_rows), use_container_width=True, hide_index=True)
+    st.dataframe(df_filtered.iloc[:max_rows].loc[:, display_columns], use_container_width=True, hide_index=True)
     
     # === BOTÓN DE DESCARGA ===
-    csv = df_filtered.to_csv(index=False)
-    st.download_button(
-        label="📥 Descargar datos filtrados (CSV)",
-        data=csv,
-        file_name=f"disponibilidad_filtrado_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-        mime="text/csv",
-        key="disponibilidad_download"
-    )
\ No newline at end of file
+    # El CSV solo se genera si el usuario lo prepara
+    if st.checkbox("📦 Preparar archivo de descarga", value=False, key="disponibilidad_prepare_download"):
+        csv = dataframe_to_csv_bytes(df_filtered)
+        st.download_button(
+            label="📥 Descargar datos filtrados (CSV)",
+            data=csv,
+            file_name=f"disponibilidad_filtrado_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+            mime="text/csv",
+            key="disponibilidad_download"
+        )
\ No newline at end of file
@@ -1,45 +1,252 @@
 import streamlit as st
+import math
 import pandas as pd
-import plotly.express as px
+import numpy as np
+import plotly.graph_objects as go
 from datetime import datetime
+import pyarrow.compute as pc
+from utils.helpers import keyed_csv_bytes, arrow_case_map, sorted_unique_values
+from utils.data_loader import LOADED_FILES_CACHE_ENTRIES
 
-def create_provision_dashboard(df_provision):
-    """
-    Crea el dashboard de provisionamiento con drill-down jerárquico
+# Encabezado del módulo
+MODULE_HEADER_HTML = '<h2 class="module-header">🏗️ Análisis de Provisionamiento</h2>'
+
+# Niveles de la jerarquía geográfica, de mayor a menor
+HIERARCHY_COLUMNS = ['Departamento', 'Provincia', 'Distrito', 'Localidad']
+
+# Keys de los selectores del drill-down (se descartan al cambiar de archivo)
+DRILL_WIDGET_KEYS = ("provision_departamento", "provision_provincia", "provision_distrito")
+
+# Filas por página en la tabla de sites del nivel 4
+SITES_PAGE_SIZE = 1000
+
+@st.cache_data(show_spinner=False, max_entries=LOADED_FILES_CACHE_ENTRIES)
+def prepare_provision_data(file_id, _df_provision):
     """
-    st.markdown('<h2 class="module-header">🏗️ Análisis de Provisionamiento</h2>', unsafe_allow_html=True)
-    
-    if df_provision is None:
-        st.warning("⚠️ No se ha cargado el archivo de Provisionamiento")
-        st.info("Sube un archivo CSV desde el panel lateral para ver el análisis.")
-        return
+    Formatea columnas geográficas y fecha de activación una sola vez por archivo subido
     
-    # === FORMATEAR DATASET ===
-    df_formatted = df_provision.copy()
+    Args:
+        file_id: Identificador del archivo subido (key de caché)
+        _df_provision: DataFrame de provisión (no se hashea)
+        
+    Returns:
+        Tuple: (DataFrame formateado y ordenado por jerarquía, MultiIndex de la jerarquía o None)
+    """
+    # Copia superficial: las columnas formateadas se reemplazan enteras
+    df_formatted = _df_provision.copy(deep=False)
     
-    # Formatear columnas geográficas a mayúsculas
-    geo_columns = ['Departamento', 'Provincia', 'Distrito', 'Localidad']
-    for col in geo_columns:
+    # Formatear columnas geográficas a mayúsculas, como category (groupby, filtros y
+    # selectores trabajan sobre códigos enteros en lugar de textos)
+    for col in HIERARCHY_COLUMNS:
         if col in df_formatted.columns:
-            df_formatted[col] = df_formatted[col].astype(str).str.upper()
+            df_formatted[col] = arrow_case_map(df_formatted[col], pc.utf8_upper)
+            # Categorías en orden alfabético: los selectores las listan sin ordenar
+            df_formatted[col] = df_formatted[col].cat.reorder_categories(
+                sorted(df_formatted[col].cat.categories)
+            )
     
     # Formatear fecha
     if 'Fecha_Activacion' in df_formatted.columns:
         try:
             # Convertir fecha desde formato "10/04/2024" a datetime y luego formatear
-            df_formatted['Fecha_Activacion_Clean'] = pd.to_datetime(df_formatted['Fecha_Activacion'], format='%d/%m/%Y', errors='coerce')
-            df_formatted['Fecha_Activacion'] = df_formatted['Fecha_Activacion_Clean'].dt.strftime('%d/%m/%Y')
-            df_formatted = df_formatted.drop('Fecha_Activacion_Clean', axis=1)
+            fecha_activacion = pd.to_datetime(df_formatted['Fecha_Activacion'], format='%d/%m/%Y', errors='coerce')
+            df_formatted['Fecha_Activacion'] = fecha_activacion.dt.strftime('%d/%m/%Y')
         except:
             # Si falla, mantener formato original
             pass
     
-    # Usar dataset formateado de aquí en adelante
-    df_provision = df_formatted
+    # Orden por la jerarquía (prefijo contiguo de niveles presentes): cada departamento,
+    # provincia o distrito queda como un bloque contiguo de filas
+    index_columns = []
+    for col in HIERARCHY_COLUMNS:
+        if col not in df_formatted.columns:
+            break
+        index_columns.append(col)
+    
+    if not index_columns:
+        return df_formatted, None
+    
+    df_formatted = df_formatted.sort_values(index_columns, kind="stable").reset_index(drop=True)
+    hierarchy_index = pd.MultiIndex.from_frame(df_formatted[index_columns])
+    
+    return df_formatted, hierarchy_index
+
+def hierarchy_rows(df_provision, hierarchy_index, keys):
+    """
+    Filas de una selección jerárquica como slice del DataFrame ordenado
+    
+    Args:
+        df_provision: DataFrame ordenado por jerarquía
+        hierarchy_index: MultiIndex de la jerarquía (mismo orden que df_provision)
+        keys: Valores seleccionados desde el primer nivel, p. ej. (departamento, provincia)
+        
+    Returns:
+        DataFrame con las filas de la selección (búsqueda binaria, sin máscaras)
+    """
+    # slice_locs falla con valores que no están en los niveles (p. ej. una selección
+    # hecha sobre otro archivo): sin filas en ese caso
+    if any(key not in level for key, level in zip(keys, hierarchy_index.levels)):
+        return df_provision.iloc[0:0]
+    
+    start, stop = hierarchy_index.slice_locs(keys, keys)
+    return df_provision.iloc[start:stop]
+
+def initial_drill_state(file_id):
+    """
+    Estado inicial del drill-down jerárquico
+    
+    Args:
+        file_id: Identificador del archivo al que pertenece la navegación
+        
+    Returns:
+        Dict sin niveles seleccionados
+    """
+    return {
+        "file_id": file_id,
+        "current_level": 0,
+        "selected_departamento": None,
+        "selected_provincia": None,
+        "selected_distrito": None,
+        "selected_localidad": None
+    }
+
+@st.cache_data(show_spinner=False)
+def hierarchy_combinations(file_id, _df_provision, columns: tuple):
+    """
+    Combinaciones únicas de las columnas jerárquicas (una sola pasada por archivo)
+    
+    Args:
+        file_id: Identificador del archivo subido (key de caché)
+        _df_provision: DataFrame de provisión formateado (no se hashea)
+        columns: Columnas jerárquicas disponibles
+        
+    Returns:
+        DataFrame con una fila por combinación única
+    """
+    # Las columnas jerárquicas son category: se deduplica la matriz de códigos enteros
+    # con un único sort en C, sin hashear tuplas de textos
+    codes = np.stack(
+        [_df_provision[col].cat.codes.to_numpy(dtype=np.int32) for col in columns], axis=1
+    )
+    unique_codes = np.unique(codes, axis=0)
+    
+    return pd.DataFrame({
+        col: pd.Categorical.from_codes(unique_codes[:, i], dtype=_df_provision[col].dtype)
+        for i, col in enumerate(columns)
+    })
+
+@st.cache_data(show_spinner=False)
+def hierarchy_level_counts(file_id, _unique_hierarchy, columns: tuple):
+    """
+    Cantidad de valores únicos por nivel jerárquico en una sola pasada
+    
+    Un nivel cuyos niveles superiores están todos presentes se cuenta como prefijo
+    único de la jerarquía (p. ej. pares Departamento-Provincia); si no, como valores
+    únicos de su propia columna.
+    
+    Args:
+        file_id: Identificador del archivo subido (key de caché)
+        _unique_hierarchy: Combinaciones únicas ordenadas de hierarchy_combinations (no se hashea)
+        columns: Columnas jerárquicas disponibles, en orden de jerarquía
+        
+    Returns:
+        Dict {columna: cantidad}
+    """
+    codes = np.column_stack(
+        [_unique_hierarchy[col].cat.codes.to_numpy() for col in columns]
+    )
+    # Las combinaciones vienen ordenadas: cada prefijo nuevo empieza donde cambia algún
+    # código de sus columnas respecto a la fila anterior
+    changes = codes[1:] != codes[:-1]
+    
+    counts = {}
+    for i, col in enumerate(columns):
+        if len(codes) == 0:
+            counts[col] = 0
+        elif list(columns[:i + 1]) == HIERARCHY_COLUMNS[:i + 1]:
+            counts[col] = 1 + int(np.count_nonzero(changes[:, :i + 1].any(axis=1)))
+        else:
+            counts[col] = _unique_hierarchy[col].nunique()
+    
+    return counts
+
+@st.cache_data(show_spinner=False)
+def level_stats(selection_key, _df_level, level_col, child_col, child_label):
+    """
+    Sites por valor de un nivel y cantidad de valores únicos del nivel siguiente
+    
+    Se cachea por selección, así volver a un departamento o provincia ya visitado
+    no recalcula sus agregados.
+    
+    Args:
+        selection_key: (file_id, niveles superiores seleccionados...), key de caché
+        _df_level: DataFrame ya filtrado por los niveles superiores (no se hashea)
+        level_col: Columna del nivel a resumir
+        child_col: Columna del nivel siguiente (None si no existe)
+        child_label: Nombre de la columna con el conteo del nivel siguiente
+        
+    Returns:
+        DataFrame con level_col, Sites y child_label, ordenado por Sites
+    """
+    # value_counts de una category incluye las categorías sin filas, que se descartan
+    stats = _df_level[level_col].value_counts(sort=False).rename("Sites")
+    stats = stats[stats > 0].rename_axis(level_col).reset_index()
+    
+    if child_col:
+        child_counts = (
+            _df_level.groupby(level_col, observed=True, sort=False)[child_col]
+            .nunique()
+            .rename(child_label)
+            .reset_index()
+        )
+        stats = stats.merge(child_counts, on=level_col)
+    
+    return stats.sort_values('Sites', ascending=False).reset_index(drop=True)
+
+@st.cache_data(show_spinner=False)
+def level_bar_figure(selection_key, _stats, level_col, title, colorscale):
+    """
+    Gráfico de barras horizontales de sites por valor de un nivel, cacheado por selección
+    
+    Se construye con go.Bar directamente, sin la introspección de columnas de px.bar.
+    
+    Args:
+        selection_key: (file_id, niveles superiores seleccionados...), key de caché
+        _stats: Stats del nivel con level_col y Sites (no se hashea)
+        level_col: Columna del nivel
+        title: Título del gráfico
+        colorscale: Escala de colores según el número de sites
+        
+    Returns:
+        Figura de Plotly
+    """
+    sites = _stats["Sites"].to_numpy()
+    fig = go.Figure(go.Bar(
+        x=sites,
+        y=_stats[level_col].astype(str).to_numpy(),
+        orientation='h',
+        marker=dict(color=sites, colorscale=colorscale, showscale=True, colorbar=dict(title="Sites"))
+    ))
+    fig.update_layout(title=title, xaxis_title="Sites", yaxis_title=level_col, height=400)
+    return fig
+
+def create_provision_dashboard(df_provision):
+    """
+    Crea el dashboard de provisionamiento con drill-down jerárquico
+    """
+    st.markdown(MODULE_HEADER_HTML, unsafe_allow_html=True)
+    
+    if df_provision is None:
+        st.warning("⚠️ No se ha cargado el archivo de Provisionamiento")
+        st.info("Sube un archivo CSV desde el panel lateral para ver el análisis.")
+        return
+    
+    # === FORMATEAR DATASET === (cacheado por archivo subido)
+    file_id = st.session_state["file_ids"].get("Provision")
+    df_provision, hierarchy_index = prepare_provision_data(file_id, df_provision)
     
     # Verificar columnas jerárquicas
-    hierarchy_columns = ['Departamento', 'Provincia', 'Distrito', 'Localidad']
-    available_hierarchy = [col for col in hierarchy_columns if col in df_provision.columns]
+    available_hierarchy = [col for col in HIERARCHY_COLUMNS if col in df_provision.columns]
     
     if len(available_hierarchy) < 2:
         st.error("❌ Se necesitan al menos 2 niveles jerárquicos (Departamento, Provincia, Distrito, Localidad)")
@@ -48,47 +255,32 @@ def create_provision_dashboard(df_provision):
     # === MÉTRICAS PRINCIPALES (CORREGIDAS PARA JERARQUÍA) ===
     st.subheader("📊 Resumen General")
     
+    # Combinaciones únicas de la jerarquía (cacheadas por archivo); los conteos de cada
+    # nivel se hacen sobre esta tabla pequeña en lugar de agrupar todas las filas otra vez
+    unique_hierarchy = hierarchy_combinations(file_id, df_provision, tuple(available_hierarchy))
+    
+    # Conteos de las cinco métricas en una sola pasada cacheada sobre los códigos
+    level_counts = hierarchy_level_counts(file_id, unique_hierarchy, tuple(available_hierarchy))
+    
     col1, col2, col3, col4, col5 = st.columns(5)
     
     with col1:
         st.metric("🏗️ Total Sites", f"{len(df_provision):,}")
     
     with col2:
-        if "Departamento" in df_provision.columns:
-            dept_count = df_provision["Departamento"].nunique()
-            st.metric("🌍 Departamentos", dept_count)
-        else:
-            st.metric("🌍 Departamentos", "N/A")
+        st.metric("🌍 Departamentos", level_counts.get("Departamento", "N/A"))
     
     with col3:
-        if "Provincia" in df_provision.columns and "Departamento" in df_provision.columns:
-            # Contar provincias únicas considerando la jerarquía
-            prov_count = df_provision.groupby(["Departamento", "Provincia"]).size().shape[0]
-            st.metric("🏛️ Provincias", prov_count)
-        elif "Provincia" in df_provision.columns:
-            st.metric("🏛️ Provincias", df_provision["Provincia"].nunique())
-        else:
-            st.metric("🏛️ Provincias", "N/A")
+        # Provincias únicas considerando la jerarquía cuando Departamento está presente
+        st.metric("🏛️ Provincias", level_counts.get("Provincia", "N/A"))
     
     with col4:
-        if "Distrito" in df_provision.columns and "Provincia" in df_provision.columns and "Departamento" in df_provision.columns:
-            # Contar distritos únicos considerando la jerarquía completa
-            dist_count = df_provision.groupby(["Departamento", "Provincia", "Distrito"]).size().shape[0]
-            st.metric("🏘️ Distritos", dist_count)
-        elif "Distrito" in df_provision.columns:
-            st.metric("🏘️ Distritos", df_provision["Distrito"].nunique())
-        else:
-            st.metric("🏘️ Distritos", "N/A")
+        # Distritos únicos considerando la jerarquía completa
+        st.metric("🏘️ Distritos", level_counts.get("Distrito", "N/A"))
     
     with col5:
-        if "Localidad" in df_provision.columns and "Distrito" in df_provision.columns and "Provincia" in df_provision.columns and "Departamento" in df_provision.columns:
-            # Contar localidades únicas considerando la jerarquía completa
-            loc_count = df_provision.groupby(["Departamento", "Provincia", "Distrito", "Localidad"]).size().shape[0]
-            st.metric("📍 Localidades", loc_count)
-        elif "Localidad" in df_provision.columns:
-            st.metric("📍 Localidades", df_provision["Localidad"].nunique())
-        else:
-            st.metric("📍 Localidades", "N/A")
+        # Localidades únicas considerando la jerarquía completa
+        st.metric("📍 Localidades", level_counts.get("Localidad", "N/A"))
     
     st.divider()
     
@@ -96,56 +288,55 @@ def create_provision_dashboard(df_provision):
     st.subheader("🔍 Explorador Jerárquico")
     st.caption("Navega nivel por nivel: Departamento → Provincia → Distrito → Localidad → Sites")
     
-    # Variables de estado para el drill-down
-    if "provision_drill_state" not in st.session_state:
-        st.session_state.provision_drill_state = {
-            "current_level": 0,
-            "selected_departamento": None,
-            "selected_provincia": None,
-            "selected_distrito": None,
-            "selected_localidad": None
-        }
+    # Variables de estado para el drill-down (referencia local al mismo dict de la sesión:
+    # los cambios hechos a través de drill_state persisten entre reruns)
+    drill_state = st.session_state.get("provision_drill_state")
+    if drill_state is None or drill_state.get("file_id") != file_id:
+        # Archivo nuevo: la selección anterior puede no existir en él
+        drill_state = initial_drill_state(file_id)
+        st.session_state.provision_drill_state = drill_state
+        for widget_key in DRILL_WIDGET_KEYS:
+            st.session_state.pop(widget_key, None)
     
     # Función para resetear niveles inferiores
     def reset_lower_levels(from_level):
         if from_level <= 1:
-            st.session_state.provision_drill_state["selected_provincia"] = None
+            drill_state["selected_provincia"] = None
         if from_level <= 2:
-            st.session_state.provision_drill_state["selected_distrito"] = None
+            drill_state["selected_distrito"] = None
         if from_level <= 3:
-            st.session_state.provision_drill_state["selected_localidad"] = None
+            drill_state["selected_localidad"] = None
     
     # NIVEL 1: DEPARTAMENTOS
     st.markdown("### 🌍 **Nivel 1: Departamentos**")
     
     # Calcular stats por departamento (CORREGIDO)
     if "Departamento" in df_provision.columns:
-        dept_stats = df_provision.groupby("Departamento").agg({
-            df_provision.columns[0]: 'count'  # Count de registros (sites)
-        }).round(0)
-        dept_stats.columns = ['Sites']
-        
-        # Calcular provincias y distritos únicos por departamento (considerando jerarquía)
-        if "Provincia" in df_provision.columns:
-            prov_por_dept = df_provision.groupby("Departamento")["Provincia"].nunique().reset_index()
-            prov_por_dept.columns = ["Departamento", "Provincias"]
-            dept_stats = dept_stats.reset_index().merge(prov_por_dept, on="Departamento")
+        # Sites y provincias únicas por departamento (cacheado por archivo)
+        dept_stats = level_stats(
+            (file_id,), df_provision, "Departamento",
+            "Provincia" if "Provincia" in df_provision.columns else None, "Provincias"
+        )
         
         if "Distrito" in df_provision.columns and "Provincia" in df_provision.columns:
             # Contar distritos únicos por departamento considerando provincia
-            dist_por_dept = df_provision.groupby("Departamento").apply(
-                lambda x: x.groupby(["Provincia", "Distrito"]).size().shape[0]
-            ).reset_index()
-            dist_por_dept.columns = ["Departamento", "Distritos"]
+            # (pares únicos a partir de la tabla de jerarquía ya deduplicada, sin apply)
+            dist_por_dept = (
+                unique_hierarchy[["Departamento", "Provincia", "Distrito"]]
+                .drop_duplicates()
+                .groupby("Departamento", observed=True, sort=False)
+                .size()
+                .rename("Distritos")
+                .reset_index()
+            )
+            # merge conserva el orden por sites de dept_stats
             dept_stats = dept_stats.merge(dist_por_dept, on="Departamento")
         
-        dept_stats = dept_stats.sort_values('Sites', ascending=False).reset_index(drop=True)
-        
         # Selector de departamento
         dept_col1, dept_col2 = st.columns([1, 2])
         
         with dept_col1:
-            departamentos = ["Seleccionar..."] + sorted(df_provision["Departamento"].unique().tolist())
+            departamentos = ["Seleccionar..."] + sorted_unique_values(df_provision["Departamento"])
             selected_dept = st.selectbox(
                 "🎯 Seleccionar Departamento:",
                 departamentos,
@@ -154,51 +345,41 @@ def create_provision_dashboard(df_provision):
             )
             
             if selected_dept != "Seleccionar...":
-                if st.session_state.provision_drill_state["selected_departamento"] != selected_dept:
-                    st.session_state.provision_drill_state["selected_departamento"] = selected_dept
+                if drill_state["selected_departamento"] != selected_dept:
+                    drill_state["selected_departamento"] = selected_dept
                     reset_lower_levels(1)
         
         with dept_col2:
             # Gráfico de departamentos
-            fig_dept = px.bar(
-                dept_stats.head(10),
-                x='Sites',
-                y='Departamento',
-                orientation='h',
-                title="Top 10 Departamentos por Número de Sites",
-                color='Sites',
-                color_continuous_scale='viridis'
+            fig_dept = level_bar_figure(
+                (file_id,), dept_stats.head(10), "Departamento",
+                "Top 10 Departamentos por Número de Sites", 'viridis'
             )
-            fig_dept.update_layout(height=400)
             st.plotly_chart(fig_dept, use_container_width=True)
     
     # NIVEL 2: PROVINCIAS (si hay departamento seleccionado)
-    if st.session_state.provision_drill_state["selected_departamento"]:
+    if drill_state["selected_departamento"]:
         st.markdown("### 🏛️ **Nivel 2: Provincias**")
-        st.info(f"📍 Departamento seleccionado: **{st.session_state.provision_drill_state['selected_departamento']}**")
+        st.info(f"📍 Departamento seleccionado: **{drill_state['selected_departamento']}**")
         
         # Filtrar por departamento
-        df_dept = df_provision[df_provision["Departamento"] == st.session_state.provision_drill_state["selected_departamento"]]
+        df_dept = hierarchy_rows(
+            df_provision, hierarchy_index,
+            (drill_state["selected_departamento"],)
+        )
         
         if "Provincia" in df_dept.columns:
-            # Stats por provincia (CORREGIDO)
-            prov_stats = df_dept.groupby("Provincia").agg({
-                df_dept.columns[0]: 'count'
-            }).round(0)
-            prov_stats.columns = ['Sites']
-            
-            # Calcular distritos únicos por provincia en este departamento
-            if "Distrito" in df_dept.columns:
-                dist_por_prov = df_dept.groupby("Provincia")["Distrito"].nunique().reset_index()
-                dist_por_prov.columns = ["Provincia", "Distritos"]
-                prov_stats = prov_stats.reset_index().merge(dist_por_prov, on="Provincia")
-            
-            prov_stats = prov_stats.sort_values('Sites', ascending=False).reset_index(drop=True)
+            # Sites y distritos únicos por provincia (cacheado por departamento seleccionado)
+            prov_stats = level_stats(
+                (file_id, drill_state["selected_departamento"]),
+                df_dept, "Provincia",
+                "Distrito" if "Distrito" in df_dept.columns else None, "Distritos"
+            )
             
             prov_col1, prov_col2 = st.columns([1, 2])
             
             with prov_col1:
-                provincias = ["Seleccionar..."] + sorted(df_dept["Provincia"].unique().tolist())
+                provincias = ["Seleccionar..."] + sorted_unique_values(df_dept["Provincia"])
                 selected_prov = st.selectbox(
                     "🎯 Seleccionar Provincia:",
                     provincias,
@@ -207,8 +388,8 @@ def create_provision_dashboard(df_provision):
                 )
                 
                 if selected_prov != "Seleccionar...":
-                    if st.session_state.provision_drill_state["selected_provincia"] != selected_prov:
-                        st.session_state.provision_drill_state["selected_provincia"] = selected_prov
+                    if drill_state["selected_provincia"] != selected_prov:
+                        drill_state["selected_provincia"] = selected_prov
                         reset_lower_levels(2)
                 
                 # Métricas de la provincia
@@ -221,48 +402,43 @@ def create_provision_dashboard(df_provision):
             
             with prov_col2:
                 # Gráfico de provincias
-                fig_prov = px.bar(
-                    prov_stats,
-                    x='Sites',
-                    y='Provincia',
-                    orientation='h',
-                    title=f"Provincias en {st.session_state.provision_drill_state['selected_departamento']}",
-                    color='Sites',
-                    color_continuous_scale='plasma'
+                fig_prov = level_bar_figure(
+                    (file_id, drill_state["selected_departamento"]),
+                    prov_stats, "Provincia",
+                    f"Provincias en {drill_state['selected_departamento']}", 'plasma'
                 )
-                fig_prov.update_layout(height=400)
                 st.plotly_chart(fig_prov, use_container_width=True)
     
     # NIVEL 3: DISTRITOS (si hay provincia seleccionada)
-    if st.session_state.provision_drill_state["selected_provincia"]:
+    if drill_state["selected_provincia"]:
         st.markdown("### 🏘️ **Nivel 3: Distritos**")
-        st.info(f"📍 Ruta: **{st.session_state.provision_drill_state['selected_departamento']}** → **{st.session_state.provision_drill_state['selected_provincia']}**")
+        st.info(f"📍 Ruta: **{drill_state['selected_departamento']}** → **{drill_state['selected_provincia']}**")
         
         # Filtrar por departamento y provincia
-        df_prov = df_provision[
-            (df_provision["Departamento"] == st.session_state.provision_drill_state["selected_departamento"]) &
-            (df_provision["Provincia"] == st.session_state.provision_drill_state["selected_provincia"])
-        ]
+        df_prov = hierarchy_rows(
+            df_provision, hierarchy_index,
+            (
+                drill_state["selected_departamento"],
+                drill_state["selected_provincia"]
+            )
+        )
         
         if "Distrito" in df_prov.columns:
-            # Stats por distrito (CORREGIDO)
-            dist_stats = df_prov.groupby("Distrito").agg({
-                df_prov.columns[0]: 'count'
-            }).round(0)
-            dist_stats.columns = ['Sites']
-            
-            # Calcular localidades únicas por distrito en esta provincia
-            if "Localidad" in df_prov.columns:
-                loc_por_dist = df_prov.groupby("Distrito")["Localidad"].nunique().reset_index()
-                loc_por_dist.columns = ["Distrito", "Localidades"]
-                dist_stats = dist_stats.reset_index().merge(loc_por_dist, on="Distrito")
-            
-            dist_stats = dist_stats.sort_values('Sites', ascending=False).reset_index(drop=True)
+            # Sites y localidades únicas por distrito (cacheado por provincia seleccionada)
+            dist_stats = level_stats(
+                (
+                    file_id,
+                    drill_state["selected_departamento"],
+                    drill_state["selected_provincia"]
+                ),
+                df_prov, "Distrito",
+                "Localidad" if "Localidad" in df_prov.columns else None, "Localidades"
+            )
             
             dist_col1, dist_col2 = st.columns([1, 2])
             
             with dist_col1:
-                distritos = ["Seleccionar..."] + sorted(df_prov["Distrito"].unique().tolist())
+                distritos = ["Seleccionar..."] + sorted_unique_values(df_prov["Distrito"])
                 selected_dist = st.selectbox(
                     "🎯 Seleccionar Distrito:",
                     distritos,
@@ -271,8 +447,8 @@ def create_provision_dashboard(df_provision):
                 )
                 
                 if selected_dist != "Seleccionar...":
-                    if st.session_state.provision_drill_state["selected_distrito"] != selected_dist:
-                        st.session_state.provision_drill_state["selected_distrito"] = selected_dist
+                    if drill_state["selected_distrito"] != selected_dist:
+                        drill_state["selected_distrito"] = selected_dist
                         reset_lower_levels(3)
                 
                 # Métricas del distrito
@@ -285,74 +461,86 @@ def create_provision_dashboard(df_provision):
             
             with dist_col2:
                 # Gráfico de distritos
-                fig_dist = px.bar(
-                    dist_stats,
-                    x='Sites',
-                    y='Distrito',
-                    orientation='h',
-                    title=f"Distritos en {st.session_state.provision_drill_state['selected_provincia']}",
-                    color='Sites',
-                    color_continuous_scale='cividis'
+                fig_dist = level_bar_figure(
+                    (
+                        file_id,
+                        drill_state["selected_departamento"],
+                        drill_state["selected_provincia"]
+                    ),
+                    dist_stats, "Distrito",
+                    f"Distritos en {drill_state['selected_provincia']}", 'cividis'
                 )
-                fig_dist.update_layout(height=400)
                 st.plotly_chart(fig_dist, use_container_width=True)
     
     # NIVEL 4: SITES (si hay distrito seleccionado)
-    if st.session_state.provision_drill_state["selected_distrito"]:
+    if drill_state["selected_distrito"]:
         st.markdown("### 📍 **Nivel 4: Sites**")
-        st.info(f"📍 Ruta: **{st.session_state.provision_drill_state['selected_departamento']}** → **{st.session_state.provision_drill_state['selected_provincia']}** → **{st.session_state.provision_drill_state['selected_distrito']}**")
+        st.info(f"📍 Ruta: **{drill_state['selected_departamento']}** → **{drill_state['selected_provincia']}** → **{drill_state['selected_distrito']}**")
         
         # Filtrar hasta distrito
-        df_dist = df_provision[
-            (df_provision["Departamento"] == st.session_state.provision_drill_state["selected_departamento"]) &
-            (df_provision["Provincia"] == st.session_state.provision_drill_state["selected_provincia"]) &
-            (df_provision["Distrito"] == st.session_state.provision_drill_state["selected_distrito"])
-        ]
+        df_dist = hierarchy_rows(
+            df_provision, hierarchy_index,
+            (
+                drill_state["selected_departamento"],
+                drill_state["selected_provincia"],
+                drill_state["selected_distrito"]
+            )
+        )
         
         # === TABLA DE SITES ===
         st.subheader("🗼 Sites en el Distrito")
         
-        # Mostrar tabla con todas las columnas
+        # Mostrar tabla con todas las columnas, paginada para no serializar todo el distrito
+        total_pages = max(1, math.ceil(len(df_dist) / SITES_PAGE_SIZE))
+        page = 1
+        if total_pages > 1:
+            page = st.number_input(
+                f"Página (de {total_pages}, {SITES_PAGE_SIZE:,} filas por página)",
+                min_value=1,
+                max_value=total_pages,
+                value=1,
+                step=1
+            )
+        start = (page - 1) * SITES_PAGE_SIZE
         st.dataframe(
-            df_dist,
+            df_dist.iloc[start:start + SITES_PAGE_SIZE],
             use_container_width=True,
             hide_index=True
         )
+        if total_pages > 1:
+            st.caption(f"Mostrando filas {start + 1:,} a {min(start + SITES_PAGE_SIZE, len(df_dist)):,} de {len(df_dist):,}")
     
     # Botón para resetear navegación
     st.divider()
     if st.button("🔄 Reiniciar Navegación", type="secondary"):
-        st.session_state.provision_drill_state = {
-            "current_level": 0,
-            "selected_departamento": None,
-            "selected_provincia": None,
-            "selected_distrito": None,
-            "selected_localidad": None
-        }
+        st.session_state.provision_drill_state = initial_drill_state(file_id)
         st.rerun()
     
     # Botón de descarga (datos filtrados según navegación)
-    df_export = df_provision.copy()
-    if st.session_state.provision_drill_state["selected_departamento"]:
-        df_export = df_export[df_export["Departamento"] == st.session_state.provision_drill_state["selected_departamento"]]
-        if st.session_state.provision_drill_state["selected_provincia"]:
-            df_export = df_export[df_export["Provincia"] == st.session_state.provision_drill_state["selected_provincia"]]
-            if st.session_state.provision_drill_state["selected_distrito"]:
-                df_export = df_export[df_export["Distrito"] == st.session_state.provision_drill_state["selected_distrito"]]
-    
-    csv = df_export.to_csv(index=False)
-    download_name = "provisionamiento"
-    if st.session_state.provision_drill_state["selected_distrito"]:
-        download_name += f"_{st.session_state.provision_drill_state['selected_distrito']}"
-    elif st.session_state.provision_drill_state["selected_provincia"]:
-        download_name += f"_{st.session_state.provision_drill_state['selected_provincia']}"
-    elif st.session_state.provision_drill_state["selected_departamento"]:
-        download_name += f"_{st.session_state.provision_drill_state['selected_departamento']}"
-    
-    st.download_button(
-        label=f"📥 Descargar datos filtrados ({len(df_export)} registros)",
-        data=csv,
-        file_name=f"{download_name}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-        mime="text/csv",
-        key="provision_download_filtered"
-    )
\ No newline at end of file
+    # Niveles seleccionados desde el departamento hasta el primero sin selección
+    export_keys = []
+    for level in ("selected_departamento", "selected_provincia", "selected_distrito"):
+        if not drill_state[level]:
+            break
+        export_keys.append(drill_state[level])
+    
+    df_export = hierarchy_rows(df_provision, hierarchy_index, tuple(export_keys)) if export_keys else df_provision
+    
+    # El CSV solo se genera si el usuario lo prepara; se cachea por archivo y selección
+    if st.checkbox("📦 Preparar archivo de descarga", value=False, key="provision_prepare_download"):
+        csv = keyed_csv_bytes((file_id, *export_keys), df_export)
+        download_name = "provisionamiento"
+        if drill_state["selected_distrito"]:
+            download_name += f"_{drill_state['selected_distrito']}"
+        elif drill_state["selected_provincia"]:
+            download_name += f"_{drill_state['selected_provincia']}"
+        elif drill_state["selected_departamento"]:
+            download_name += f"_{drill_state['selected_departamento']}"
+        
+        st.download_button(
+            label=f"📥 Descargar datos filtrados ({len(df_export)} registros)",
+            data=csv,
+            file_name=f"{download_name}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+            mime="text/csv",
+            key="provision_download_filtered"
+        )
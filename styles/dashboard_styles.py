@@ -56,6 +56,29 @@ def get_dashboard_styles():
             font-weight: bold;
         }
         
+        /* Tarjetas de estado por módulo (resumen general) */
+        .module-grid {
+            display: grid;
+            grid-template-columns: repeat(3, 1fr);
+            gap: 1rem;
+        }
+        
+        .module-card {
+            padding: 1rem;
+            border-radius: 8px;
+            line-height: 1.8;
+        }
+        
+        .card-ok {
+            background-color: #d4edda;
+            color: #155724;
+        }
+        
+        .card-error {
+            background-color: #f8d7da;
+            color: #721c24;
+        }
+        
         /* Estilos para mapas */
         .map-container {
             border: 1px solid #ddd;
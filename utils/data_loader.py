@@ -1,5 +1,35 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import os
+import tempfile
+import time
+from io import BytesIO
+from hashlib import blake2b
+from pathlib import Path
+from functools import lru_cache
+from typing import Optional
+from utils.helpers import SITE_COLUMN, SITE_COLUMN_CANDIDATES
+
+# Directorio del caché Parquet de archivos ya procesados (configurable por entorno;
+# por defecto en el directorio temporal del sistema, no en el directorio de trabajo)
+PARQUET_CACHE_DIR = Path(
+    os.environ.get("NETWORK_DASHBOARD_CACHE_DIR")
+    or Path(tempfile.gettempdir()) / "network-dashboard" / "datasets"
+)
+
+# Versión del pipeline de carga: forma parte de la key del caché en disco, de modo que
+# los archivos procesados con una versión anterior no se vuelvan a servir.
+# Incrementar al cambiar read_csv_table, dictionary_encode_low_cardinality,
+# prepare_loaded_dataframe o cualquier paso que altere el DataFrame cargado.
+LOAD_PIPELINE_VERSION = 2
+
+# Límites del caché en disco: se expulsan las entradas más antiguas
+PARQUET_CACHE_MAX_BYTES = 1 << 30
+PARQUET_CACHE_MAX_AGE_SECONDS = 7 * 24 * 3600
 
 def initialize_session_state():
     """Inicializa el estado de la sesión con todos los datasets"""
@@ -13,22 +43,32 @@ def initialize_session_state():
             "Calidad": None,
             "Proyectos": None
         }
+    
+    # Metadatos (filas, columnas) de cada dataset cargado, calculados una sola vez
+    if "meta" not in st.session_state:
+        st.session_state["meta"] = {}
+    
+    # file_id del archivo subido del que proviene cada dataset
+    if "file_ids" not in st.session_state:
+        st.session_state["file_ids"] = {}
+
+# Palabras clave del nombre de archivo para cada tipo de dataset (en orden de prioridad)
+DETECTION_RULES = {
+    "Averias": ("averia", "alarm", "fault"),
+    "Desempeño": ("desempe", "performance", "kpi"),
+    "Configuration": ("config", "configuracion"),
+    "Provision": ("provision", "provisi"),
+    "Disponibilidad": ("dispon", "availability"),
+    "Calidad": ("calidad", "quality"),
+    "Proyectos": ("proyecto", "project", "site")
+}
 
-def detect_dataset_type(filename: str) -> str:
+@lru_cache(maxsize=256)
+def detect_dataset_type(filename: str) -> Optional[str]:
     """Detecta el tipo de dataset basado en el nombre del archivo"""
     name = filename.lower()
     
-    detection_rules = {
-        "Averias": ["averia", "alarm", "fault"],
-        "Desempeño": ["desempe", "performance", "kpi"],
-        "Configuration": ["config", "configuracion"],
-        "Provision": ["provision", "provisi"],
-        "Disponibilidad": ["dispon", "availability"],
-        "Calidad": ["calidad", "quality"],
-        "Proyectos": ["proyecto", "project", "site"]
-    }
-    
-    for dataset_type, keywords in detection_rules.items():
+    for dataset_type, keywords in DETECTION_RULES.items():
         if any(keyword in name for keyword in keywords):
             return dataset_type
     
@@ -36,53 +76,269 @@ def detect_dataset_type(filename: str) -> str:
 
 def clean_and_reorder_columns(df):
     """Función auxiliar para limpiar y reordenar columnas"""
-    columns_lower = [col.lower() for col in df.columns]
-    columns = list(df.columns)
+    # Nombre original de cada columna según su nombre en minúsculas (primera aparición)
+    lower_map = {}
+    for col in df.columns:
+        lower_map.setdefault(col.lower(), col)
     
     # Eliminar start_time.1 si existe
-    if 'start_time.1' in columns_lower:
-        start_time_1_idx = columns_lower.index('start_time.1')
-        original_start_time_1_name = columns[start_time_1_idx]
-        df = df.drop(original_start_time_1_name, axis=1)
-        columns = list(df.columns)
-        columns_lower = [col.lower() for col in df.columns]
-    
-    priority_columns = []
-    
-    # Buscar start_time
-    if 'start_time' in columns_lower:
-        start_time_idx = columns_lower.index('start_time')
-        original_start_name = columns[start_time_idx]
-        priority_columns.append(original_start_name)
-        columns.remove(original_start_name)
-    
-    # Buscar end_time
-    if 'end_time' in columns_lower:
-        # Actualizar columns_lower después de remover start_time
-        columns_lower = [col.lower() for col in columns]
-        if 'end_time' in columns_lower:
-            end_time_idx = columns_lower.index('end_time')
-            original_end_name = columns[end_time_idx]
-            priority_columns.append(original_end_name)
-            columns.remove(original_end_name)
-    
-    new_column_order = priority_columns + columns
-    return df[new_column_order]
+    start_time_1 = lower_map.get('start_time.1')
+    
+    # start_time y end_time primero; el resto conserva su orden
+    priority_columns = [lower_map[key] for key in ('start_time', 'end_time') if key in lower_map]
+    other_columns = [col for col in df.columns if col not in priority_columns and col != start_time_1]
+    
+    return df[priority_columns + other_columns]
+
+def deduplicate_column_names(names):
+    """
+    Renombra columnas repetidas como lo hace pandas (start_time, start_time.1, ...)
+    
+    Args:
+        names: Nombres de columna en el orden del archivo
+        
+    Returns:
+        Lista de nombres sin repetidos
+    """
+    seen = set()
+    result = []
+    for name in names:
+        new_name = name
+        suffix = 1
+        while new_name in seen:
+            new_name = f"{name}.{suffix}"
+            suffix += 1
+        seen.add(new_name)
+        result.append(new_name)
+    return result
+
+def read_csv_arrow(file, separator=";", encoding='utf-8', block_size=8 << 20) -> pa.Table:
+    """
+    Lee un CSV por bloques con el lector en streaming de pyarrow
+    
+    Todas las columnas se leen como texto, lo que evita la inferencia de tipos;
+    cada módulo convierte después sus columnas numéricas y de fecha.
+    """
+    data = pa.py_buffer(file.read())
+    read_options = pacsv.ReadOptions(encoding=encoding, block_size=block_size)
+    parse_options = pacsv.ParseOptions(delimiter=separator)
+    
+    # El primer bloque basta para conocer los nombres de columna
+    column_names = pacsv.open_csv(
+        pa.BufferReader(data), read_options=read_options, parse_options=parse_options
+    ).schema.names
+    convert_options = pacsv.ConvertOptions(
+        column_types={name: pa.string() for name in column_names},
+        strings_can_be_null=True
+    )
+    
+    reader = pacsv.open_csv(
+        pa.BufferReader(data),
+        read_options=read_options,
+        parse_options=parse_options,
+        convert_options=convert_options
+    )
+    table = reader.read_all()
+    
+    # pyarrow conserva los nombres repetidos tal cual; se renombran como en pandas
+    if len(set(column_names)) != len(column_names):
+        table = table.rename_columns(deduplicate_column_names(column_names))
+    
+    return table
+
+def read_csv_table(file, separator=";", encoding='utf-8') -> pa.Table:
+    """
+    Lee un CSV como tabla Arrow, con el parser C de pandas como respaldo
+    
+    pyarrow reporta con el mismo ArrowInvalid el texto mal codificado y las filas con
+    menos columnas. Si el contenido no decodifica se lanza UnicodeDecodeError (el
+    llamador reintenta con otra codificación); si decodifica, el archivo se lee con
+    pandas, que completa las celdas faltantes con NaN.
+    """
+    try:
+        return read_csv_arrow(file, separator=separator, encoding=encoding)
+    except pa.ArrowInvalid:
+        file.seek(0)
+        data = file.read()
+        data.decode(encoding)
+        df = pd.read_csv(BytesIO(data), sep=separator, dtype=str, encoding=encoding)
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+def dictionary_encode_low_cardinality(table: pa.Table, max_ratio=0.5) -> pa.Table:
+    """
+    Codifica como diccionario las columnas de texto con pocos valores distintos
+    
+    Se hace sobre la tabla Arrow (kernels multihilo de pyarrow.compute) antes de
+    pasar a pandas, donde estas columnas llegan directamente como category.
+    
+    Args:
+        table: Tabla Arrow a procesar
+        max_ratio: Proporción máxima de valores únicos sobre el total de filas
+        
+    Returns:
+        Tabla con las columnas de baja cardinalidad codificadas
+    """
+    if table.num_rows == 0:
+        return table
+    
+    for i, field in enumerate(table.schema):
+        if not pa.types.is_string(field.type):
+            continue
+        
+        column = table.column(i)
+        if pc.count_distinct(column).as_py() / table.num_rows < max_ratio:
+            table = table.set_column(i, field.name, column.dictionary_encode())
+    
+    return table
+
+def _arrow_types_mapper(arrow_type):
+    """Texto y números como tipos Arrow de pandas; diccionarios como category"""
+    if pa.types.is_dictionary(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
+def arrow_table_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    Convierte una tabla Arrow a pandas en el borde de carga
+    
+    La tabla se libera durante la conversión (self_destruct) para no duplicar el
+    pico de memoria, así que no debe usarse después de llamar a esta función.
+    """
+    return table.to_pandas(split_blocks=True, self_destruct=True, types_mapper=_arrow_types_mapper)
+
+def canonicalize_site_column(df):
+    """Renombra la columna de sites a su nombre canónico (site_name)"""
+    if SITE_COLUMN in df.columns:
+        return df
+    
+    for col in SITE_COLUMN_CANDIDATES:
+        if col in df.columns:
+            return df.rename(columns={col: SITE_COLUMN})
+    
+    return df
+
+def prepare_loaded_dataframe(df):
+    """
+    Normaliza los nombres y el orden de columnas de un DataFrame recién cargado
+    
+    Los tipos ya vienen resueltos desde Arrow: texto como string[pyarrow], más
+    compacto que las columnas object de NumPy, y las columnas de baja cardinalidad
+    (sites, estados, regiones) como category.
+    """
+    df = clean_and_reorder_columns(df)
+    return canonicalize_site_column(df)
 
 def load_csv_file(file, separator=";"):
     """Carga un archivo CSV con manejo de errores y eliminación de columnas duplicadas"""    
     try:
-        df = pd.read_csv(file, sep=separator, dtype=str, encoding='utf-8')
-        print(df.columns)
-        df = clean_and_reorder_columns(df)
-        print(df.columns)
+        table = read_csv_table(file, separator=separator, encoding='utf-8')
+        df = arrow_table_to_pandas(dictionary_encode_low_cardinality(table))
+        df = prepare_loaded_dataframe(df)
         return df, None
     except UnicodeDecodeError:
         try:
-            df = pd.read_csv(file, sep=separator, dtype=str, encoding='latin-1')
-            df = clean_and_reorder_columns(df)
+            # Reintentar desde el inicio con latin-1
+            file.seek(0)
+            table = read_csv_table(file, separator=separator, encoding='latin-1')
+            df = arrow_table_to_pandas(dictionary_encode_low_cardinality(table))
+            df = prepare_loaded_dataframe(df)
             return df, None
         except Exception as e:
             return None, f"Error de codificación: {str(e)}"
     except Exception as e:
-        return None, f"Error al cargar archivo: {str(e)}"
\ No newline at end of file
+        return None, f"Error al cargar archivo: {str(e)}"
+
+def _parquet_cache_path(file_bytes: bytes, separator: str) -> Path:
+    """Ruta del caché Parquet para un archivo, según el hash de su contenido"""
+    digest = blake2b(
+        file_bytes + separator.encode(),
+        digest_size=20,
+        person=f"v{LOAD_PIPELINE_VERSION}".encode()
+    ).hexdigest()
+    return PARQUET_CACHE_DIR / f"{digest}.parquet"
+
+def prune_parquet_cache(max_bytes=PARQUET_CACHE_MAX_BYTES, max_age=PARQUET_CACHE_MAX_AGE_SECONDS):
+    """
+    Expulsa del caché en disco las entradas vencidas y, si se excede el tamaño
+    máximo, las de uso menos reciente
+    
+    Args:
+        max_bytes: Tamaño total máximo del caché
+        max_age: Antigüedad máxima (segundos desde el último uso) de una entrada
+    """
+    now = time.time()
+    entries = []
+    for path in PARQUET_CACHE_DIR.glob("*.parquet"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if now - stat.st_mtime > max_age:
+            path.unlink(missing_ok=True)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+    
+    # Más recientes primero; se conservan mientras quepan en max_bytes
+    total = 0
+    for _, size, path in sorted(entries, key=lambda entry: entry[0], reverse=True):
+        total += size
+        if total > max_bytes:
+            path.unlink(missing_ok=True)
+
+# Entradas en memoria de load_csv_bytes; las expulsadas se recuperan del caché Parquet
+LOADED_FILES_CACHE_ENTRIES = 16
+
+@st.cache_data(show_spinner=False, max_entries=LOADED_FILES_CACHE_ENTRIES)
+def load_csv_bytes(file_bytes: bytes, filename: str, separator=";"):
+    """
+    Carga un CSV desde sus bytes, cacheado entre reruns y sesiones
+    
+    En memoria se cachea con st.cache_data (con un número acotado de entradas); en
+    disco, el DataFrame ya procesado se guarda como Parquet, de modo que ni las
+    entradas expulsadas ni las siguientes sesiones vuelven a parsear el CSV.
+
+    Args:
+        file_bytes: Contenido del archivo subido
+        filename: Nombre del archivo (forma parte de la key de caché)
+        separator: Separador de columnas
+
+    Returns:
+        Tuple: (DataFrame o None, mensaje de error o None)
+    """
+    cache_path = _parquet_cache_path(file_bytes, separator)
+    
+    if cache_path.exists():
+        try:
+            df = prepare_loaded_dataframe(arrow_table_to_pandas(pq.read_table(cache_path)))
+        except Exception:
+            # Caché corrupto o incompatible: se vuelve a parsear el CSV
+            df = None
+        
+        if df is not None:
+            try:
+                # La fecha de modificación marca el último uso (antigüedad para la expulsión)
+                os.utime(cache_path)
+            except OSError:
+                pass
+            return df, None
+    
+    df, error = load_csv_file(BytesIO(file_bytes), separator=separator)
+    
+    if df is not None:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # Se escribe en un temporal del mismo directorio y se mueve de forma atómica:
+            # otra sesión nunca ve un Parquet a medio escribir
+            fd, tmp_name = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+            os.close(fd)
+            try:
+                df.to_parquet(tmp_name, compression="zstd", index=False)
+                os.replace(tmp_name, cache_path)
+            finally:
+                Path(tmp_name).unlink(missing_ok=True)
+            prune_parquet_cache()
+        except Exception:
+            # El caché en disco es opcional (p. ej. sistema de archivos de solo lectura)
+            pass
+    
+    return df, error
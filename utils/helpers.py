@@ -1,42 +1,158 @@
+import streamlit as st
 import pandas as pd
+import numpy as np
+from io import BytesIO
+from functools import lru_cache
+import xlsxwriter
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 from typing import List, Optional
 
-def get_dataset_info(df, dataset_type):
-    """Obtiene información básica del dataset"""
-    if df is None or len(df) == 0:
-        return "No cargado", 0, []
+# Nombre canónico de la columna de sites (se normaliza al cargar cada archivo)
+SITE_COLUMN = "site_name"
+
+# Variantes de nombre aceptadas en los archivos de origen, en orden de prioridad
+SITE_COLUMN_CANDIDATES = ("Site_Name", "site_name", "SITE_NAME", "site")
+
+@lru_cache(maxsize=32)
+def _find_site_column_in(columns: tuple) -> Optional[str]:
+    """Busca la columna de sites en una tupla de nombres de columna (memoizado)"""
+    if SITE_COLUMN in columns:
+        return SITE_COLUMN
+    
+    for col in SITE_COLUMN_CANDIDATES:
+        if col in columns:
+            return col
     
-    return "Cargado", len(df), list(df.columns)
+    return None
 
 def find_site_column(df):
     """Encuentra la columna que contiene información de sites"""
     if df is None:
         return None
     
-    site_columns = ["Site_Name", "site_name", "SITE_NAME", "site"]
+    return _find_site_column_in(tuple(df.columns))
+
+def top_value_counts(series: pd.Series, n: int = 10) -> pd.Series:
+    """
+    Devuelve los n valores más frecuentes de una columna (sin conteos en cero)
     
-    for col in site_columns:
-        if col in df.columns:
-            return col
+    En columnas category cuenta sobre los códigos enteros con np.bincount y solo
+    ordena los n mayores, en lugar de un value_counts completo.
     
-    return None
+    Args:
+        series: Columna a contar
+        n: Número de valores a devolver
+        
+    Returns:
+        Serie de conteos indexada por valor, en orden descendente
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        counts = series.value_counts()
+        return counts[counts > 0].head(n)
+    
+    categories = series.cat.categories
+    codes = series.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+    
+    if len(counts) > n:
+        top_idx = np.argpartition(counts, -n)[-n:]
+    else:
+        top_idx = np.arange(len(counts))
+    top_idx = top_idx[np.argsort(counts[top_idx], kind="stable")[::-1]]
+    top_idx = top_idx[counts[top_idx] > 0]
+    
+    return pd.Series(counts[top_idx], index=categories[top_idx], name="count")
 
-def clean_date_format(date_str) -> Optional[str]:
+def isin_mask(series: pd.Series, values) -> np.ndarray:
     """
-    Limpia el formato de fecha removiendo caracteres especiales
+    Máscara booleana de pertenencia a un conjunto de valores
+    
+    En columnas category se resuelven los valores buscados a códigos una sola vez
+    y la máscara se obtiene indexando una tabla de búsqueda con los códigos enteros.
     
     Args:
-        date_str: String de fecha a limpiar
+        series: Columna a evaluar
+        values: Valores buscados
         
     Returns:
-        String de fecha limpio o None si es inválido
+        Array booleano con la máscara
     """
-    if pd.isna(date_str) or date_str == '' or str(date_str).lower() == 'nan':
-        return None
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        wanted_codes = categories.get_indexer(list(values))
+        
+        # Posición extra al final para el código -1 (nulos), siempre False
+        lookup = np.zeros(len(categories) + 1, dtype=bool)
+        lookup[wanted_codes[wanted_codes >= 0]] = True
+        return lookup[series.cat.codes.to_numpy()]
     
-    # Convertir "Aug 18, 2025 @ 06:00:00.000" a formato estándar
-    cleaned = str(date_str).replace(' @ ', ' ').replace('.000', '')
-    return cleaned.strip()
+    return series.isin(values).to_numpy()
+
+def count_value(series: pd.Series, value) -> int:
+    """
+    Cuenta las filas iguales a un valor sin construir un DataFrame filtrado
+    
+    En columnas category compara directamente los códigos enteros.
+    
+    Args:
+        series: Columna a evaluar
+        value: Valor a contar
+        
+    Returns:
+        Número de filas con ese valor
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        if value not in categories:
+            return 0
+        return int(np.count_nonzero(series.cat.codes.to_numpy() == categories.get_loc(value)))
+    
+    return int((series == value).sum())
+
+def sorted_unique_values(series: pd.Series) -> list:
+    """
+    Valores únicos no nulos de una columna, ordenados
+    
+    En columnas category solo se recorren los códigos enteros presentes y se
+    ordenan las categorías correspondientes (pocas), sin escanear los textos; si las
+    categorías ya están ordenadas, ni siquiera se ordenan.
+    
+    Args:
+        series: Columna a procesar
+        
+    Returns:
+        Lista ordenada de valores únicos
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        present_codes = np.flatnonzero(np.bincount(codes[codes >= 0], minlength=len(series.cat.categories)))
+        present_values = series.cat.categories[present_codes].tolist()
+        if series.cat.categories.is_monotonic_increasing:
+            return present_values
+        return sorted(present_values)
+    
+    return sorted(series.dropna().unique())
+
+def arrow_case_map(series, case_kernel):
+    """
+    Aplica un kernel de mayúsculas/minúsculas de pyarrow.compute a una columna de texto
+    
+    Args:
+        series: Columna a transformar (texto Arrow, object o category)
+        case_kernel: pc.utf8_upper o pc.utf8_lower
+        
+    Returns:
+        Serie category con los valores transformados
+    """
+    values = pa.array(series, from_pandas=True)
+    if not pa.types.is_string(values.type):
+        values = values.cast(pa.string())
+    
+    # Los nulos se escriben como "nan", igual que hacía astype(str)
+    values = case_kernel(pc.fill_null(values, "nan"))
+    return pd.Series(values.dictionary_encode().to_pandas(), index=series.index, name=series.name)
 
 def clean_numeric_data(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
     """
@@ -49,46 +165,81 @@ def clean_numeric_data(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
     Returns:
         DataFrame con datos numéricos limpiados
     """
-    df_clean = df.copy()
+    # Copia superficial: las columnas limpiadas se reemplazan enteras, el resto se
+    # comparte con el DataFrame original en lugar de duplicarse
+    df_clean = df.copy(deep=False)
     
     for col in columns:
-        if col in df_clean.columns:
-            def clean_european_number(value):
-                if pd.isna(value):
-                    return None
-                
-                # Convertir a string y limpiar
-                str_val = str(value).strip().replace('"', '')
-                
-                # Si no contiene números, retornar NaN
-                if not any(c.isdigit() for c in str_val):
-                    return None
-                
-                # Manejar formato europeo: "23,418.082"
-                if ',' in str_val and '.' in str_val:
-                    # Eliminar comas (separador de miles) y mantener punto (decimal)
-                    cleaned = str_val.replace(',', '')
-                elif ',' in str_val and '.' not in str_val:
-                    # Solo coma, podría ser decimal o miles
-                    parts = str_val.split(',')
-                    if len(parts) == 2 and len(parts[1]) <= 3 and len(parts[1]) > 0:
-                        # Probablemente decimal: "123,45" -> "123.45"
-                        cleaned = str_val.replace(',', '.')
-                    else:
-                        # Probablemente separador de miles: "1,234" -> "1234"
-                        cleaned = str_val.replace(',', '')
-                else:
-                    # Solo números y puntos, mantener como está
-                    cleaned = str_val
-                
-                return cleaned
-            
-            # Aplicar limpieza y convertir a numérico
-            df_clean[col] = df_clean[col].apply(clean_european_number)
-            df_clean[col] = pd.to_numeric(df_clean[col], errors='coerce')
+        if col not in df_clean.columns:
+            continue
+        
+        # Columnas ya numéricas (p. ej. desde el caché Parquet): solo se ajusta el tipo
+        if pd.api.types.is_numeric_dtype(df_clean[col]):
+            df_clean[col] = df_clean[col].astype("float32")
+            continue
+        
+        # Limpieza vectorizada sobre toda la columna (sin una llamada Python por celda)
+        values = df_clean[col].astype("string").str.strip().str.replace('"', '', regex=False)
+        has_comma = values.str.contains(',', regex=False, na=False)
+        has_dot = values.str.contains('.', regex=False, na=False)
+        
+        # Solo coma, una única vez y con 1 a 3 caracteres después: decimal "123,45" -> "123.45"
+        decimal_comma = has_comma & ~has_dot & values.str.fullmatch(r"[^,]*,[^,]{1,3}", na=False)
+        
+        # Resto de casos con coma (formato europeo "23,418.082" o miles "1,234,567"): eliminar comas
+        cleaned = values.str.replace(',', '', regex=False)
+        cleaned = cleaned.mask(decimal_comma, values.str.replace(',', '.', regex=False))
+        
+        # Si no contiene números, NaN
+        cleaned = cleaned.where(values.str.contains(r"\d", na=False))
+        
+        # float32 siempre: la mitad de bytes en cada mean/min/max posterior
+        df_clean[col] = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype=np.float32, na_value=np.nan)
     
     return df_clean
 
+def _parse_datetime_values(raw_values: pd.Series,
+                           target_format: str,
+                           create_derived_fields: bool) -> tuple[pd.Series, Optional[pd.DataFrame]]:
+    """
+    Convierte una columna de texto a datetime y calcula sus campos derivados
+    
+    No se cachea aquí: los módulos la llaman desde su preprocesado, que ya está
+    cacheado por archivo (prepare_* o session_state en averías).
+    
+    Args:
+        raw_values: Columna original con las fechas como texto
+        target_format: Formato esperado de la fecha
+        create_derived_fields: Si calcular campos derivados (hour, date, etc.)
+        
+    Returns:
+        Tuple: (Serie datetime, DataFrame de campos derivados o None)
+    """
+    # Limpiar formato con operaciones vectorizadas: "Aug 18, 2025 @ 06:00:00.000" a formato estándar
+    cleaned = (
+        raw_values.astype("string")
+        .str.replace(' @ ', ' ', regex=False)
+        .str.replace('.000', '', regex=False)
+        .str.strip()
+    )
+    
+    # Vacíos y "nan" no cumplen el formato y quedan como NaT; cache=True parsea una
+    # sola vez cada texto repetido
+    datetime_series = pd.to_datetime(cleaned, format=target_format, errors='coerce', cache=True)
+    
+    if not create_derived_fields or datetime_series.isna().all():
+        return datetime_series, None
+    
+    derived_fields = pd.DataFrame({
+        "hour": datetime_series.dt.hour,
+        "date": datetime_series.dt.date,
+        "day_of_week": datetime_series.dt.day_name(),
+        "month": datetime_series.dt.month,
+        "year": datetime_series.dt.year
+    }, index=datetime_series.index)
+    
+    return datetime_series, derived_fields
+
 def parse_datetime_column(df: pd.DataFrame, 
                          column_name: str, 
                          target_format: str = '%b %d, %Y %H:%M:%S',
@@ -105,44 +256,35 @@ def parse_datetime_column(df: pd.DataFrame,
     Returns:
         Tuple: (DataFrame procesado, éxito del parseo)
     """
+    # Copias superficiales: la columna parseada y los campos derivados se asignan
+    # enteros, así el DataFrame original no se modifica ni se duplican sus datos
     if column_name not in df.columns:
-        return df.copy(), False
+        return df.copy(deep=False), False
     
-    df_result = df.copy()
+    df_result = df.copy(deep=False)
     
     try:
-        # Limpiar formato
-        df_result[f"{column_name}_clean"] = df_result[column_name].apply(clean_date_format)
-        
-        # Convertir a datetime
-        datetime_series = pd.to_datetime(
-            df_result[f"{column_name}_clean"], 
-            format=target_format, 
-            errors='coerce'
+        # Parseo y campos derivados cacheados por contenido de la columna
+        datetime_series, derived_fields = _parse_datetime_values(
+            df_result[column_name], target_format, create_derived_fields
         )
         
         # Verificar si la conversión fue exitosa
-        valid_dates = (~datetime_series.isna()).sum()
+        valid_dates = datetime_series.notna().sum()
         
         if valid_dates > 0:
             # Sobreescribir la columna original
             df_result[column_name] = datetime_series
             
             # Crear campos derivados solo si se solicita
-            if create_derived_fields:
-                df_result["hour"] = datetime_series.dt.hour
-                df_result["date"] = datetime_series.dt.date
-                df_result["day_of_week"] = datetime_series.dt.day_name()
-                df_result["month"] = datetime_series.dt.month
-                df_result["year"] = datetime_series.dt.year
+            if derived_fields is not None:
+                for field in derived_fields.columns:
+                    df_result[field] = derived_fields[field]
             
             success = True
         else:
             success = False
         
-        # Limpiar columnas temporales
-        df_result.drop([f"{column_name}_clean"], axis=1, inplace=True, errors='ignore')
-        
         # Crear columna duration si ambas columnas de tiempo existen
         if "start_time" in df_result.columns and "end_time" in df_result.columns:
             # Verificar que ambas sean datetime
@@ -156,4 +298,286 @@ def parse_datetime_column(df: pd.DataFrame,
         return df_result, success
         
     except Exception:
-        return df_result, False
\ No newline at end of file
+        return df_result, False
+
+def date_range_mask(datetime_values: pd.Series, start_date, end_date) -> np.ndarray:
+    """
+    Máscara de filas cuya fecha cae entre start_date y end_date (ambos incluidos)
+    
+    Compara los datetime64[ns] directamente contra [inicio del día inicial,
+    inicio del día siguiente al final) en lugar de crear un objeto date por fila
+    con .dt.date.
+    
+    Args:
+        datetime_values: Columna datetime64
+        start_date: Fecha inicial (datetime.date)
+        end_date: Fecha final (datetime.date)
+        
+    Returns:
+        Array booleano con la máscara
+    """
+    values = datetime_values.to_numpy(dtype="datetime64[ns]")
+    range_start = np.datetime64(start_date, "ns")
+    range_end = np.datetime64(end_date, "ns") + np.timedelta64(1, "D")
+    
+    # Las comparaciones con NaT son False: esas filas quedan fuera de cualquier rango
+    return (values >= range_start) & (values < range_end)
+
+def date_range_slice(sorted_datetime_values: pd.Series, start_date, end_date) -> slice:
+    """
+    Slice posicional de las filas entre start_date y end_date (ambos incluidos)
+    
+    Requiere la columna ordenada de forma ascendente (NaT al final): el rango se
+    resuelve con dos búsquedas binarias, sin recorrer ni crear máscaras.
+    
+    Args:
+        sorted_datetime_values: Columna datetime64 ordenada
+        start_date: Fecha inicial (datetime.date)
+        end_date: Fecha final (datetime.date)
+        
+    Returns:
+        Slice para usar con iloc
+    """
+    values = sorted_datetime_values.to_numpy(dtype="datetime64[ns]")
+    lo = values.searchsorted(np.datetime64(start_date, "ns"), side="left")
+    hi = values.searchsorted(np.datetime64(end_date, "ns") + np.timedelta64(1, "D"), side="left")
+    return slice(lo, hi)
+
+def downsample_timeseries(df: pd.DataFrame, x_col: str, y_cols: List[str], max_points: int = 2000) -> pd.DataFrame:
+    """
+    Reduce una serie temporal a lo sumo ~max_points puntos promediando por intervalos
+    
+    El intervalo se elige a partir del rango de tiempo para que el gráfico conserve
+    su forma y el navegador reciba muchos menos puntos.
+    
+    Args:
+        df: DataFrame con la columna de tiempo y las métricas
+        x_col: Columna datetime del eje X
+        y_cols: Métricas a promediar
+        max_points: Número máximo aproximado de puntos a devolver
+        
+    Returns:
+        DataFrame con x_col y y_cols (el original si ya es pequeño)
+    """
+    if len(df) <= max_points:
+        return df
+    
+    data = df.loc[df[x_col].notna(), [x_col] + list(y_cols)]
+    span = data[x_col].max() - data[x_col].min()
+    if pd.isna(span) or span <= pd.Timedelta(0):
+        return df
+    
+    bucket = max(span / max_points, pd.Timedelta(seconds=1)).ceil("s")
+    return (
+        data.set_index(x_col)
+        .resample(bucket)
+        .mean()
+        .dropna(how="all")
+        .reset_index()
+    )
+
+# Nombres de las columnas de la tabla de estadísticas resumen
+SUMMARY_STATS_COLUMNS = {
+    "mean": "Promedio",
+    "min": "Mínimo",
+    "max": "Máximo",
+    "std": "Desv. Estándar",
+    "count": "Registros"
+}
+
+def normalize_metrics(df: pd.DataFrame, metrics: List[str]) -> tuple[pd.DataFrame, List[str]]:
+    """
+    Normaliza métricas a escala 0-100 (min-max por columna) para graficarlas juntas
+    
+    Args:
+        df: DataFrame con las métricas
+        metrics: Métricas a normalizar
+        
+    Returns:
+        Tuple: (copia superficial de df con columnas <métrica>_norm, nombres de esas columnas)
+    """
+    plot_data = df.copy(deep=False)
+    
+    # Todas las métricas en una sola matriz float32, normalizada por columnas
+    metrics_present = [metric for metric in metrics if metric in plot_data.columns]
+    if metrics_present:
+        values = plot_data[metrics_present].to_numpy(dtype=np.float32, na_value=np.nan)
+        min_vals = np.nanmin(values, axis=0)
+        max_vals = np.nanmax(values, axis=0)
+        ranges = max_vals - min_vals
+        constant = ranges == 0
+        normalized = (values - min_vals) / np.where(constant, 1, ranges) * 100
+        normalized[:, constant] = 0
+        for i, metric in enumerate(metrics_present):
+            plot_data[f"{metric}_norm"] = normalized[:, i]
+    
+    return plot_data, [f"{metric}_norm" for metric in metrics]
+
+# Formato de la tabla de estadísticas: los valores siguen siendo float y se formatean en el cliente
+SUMMARY_STATS_COLUMN_CONFIG = {
+    column: st.column_config.NumberColumn(format="%.3f")
+    for column in ("Promedio", "Mínimo", "Máximo", "Desv. Estándar")
+}
+
+def summary_statistics(df: pd.DataFrame, metrics: List[str], metric_labels: dict) -> pd.DataFrame:
+    """
+    Tabla de estadísticas resumen de las métricas, en una sola agregación
+    
+    Los valores quedan como float; se muestran con SUMMARY_STATS_COLUMN_CONFIG.
+    
+    Args:
+        df: DataFrame filtrado
+        metrics: Métricas a resumir (las ausentes se ignoran)
+        metric_labels: Nombres amigables de las métricas
+        
+    Returns:
+        DataFrame con una fila por métrica con datos (vacío si no hay ninguna)
+    """
+    metrics_present = [metric for metric in metrics if metric in df.columns]
+    stats_df = df[metrics_present].agg(list(SUMMARY_STATS_COLUMNS)).T
+    stats_df = stats_df[stats_df["count"] > 0].rename(columns=SUMMARY_STATS_COLUMNS)
+    stats_df["Registros"] = stats_df["Registros"].astype(int)
+    stats_df.insert(0, "Métrica", [metric_labels.get(metric, metric) for metric in stats_df.index])
+    return stats_df
+
+@st.cache_data(show_spinner=False)
+def grouped_means(filter_key, _df_filtered: pd.DataFrame, by: str, metrics: tuple) -> pd.DataFrame:
+    """
+    Promedios de métricas por grupo, cacheados por la selección de filtros
+    
+    Args:
+        filter_key: Archivo y filtros que determinan _df_filtered (key de caché)
+        _df_filtered: DataFrame filtrado (no se hashea)
+        by: Columna de agrupación
+        metrics: Métricas a promediar
+        
+    Returns:
+        DataFrame con un promedio por grupo y métrica
+    """
+    return _df_filtered.groupby(by, observed=True)[list(metrics)].mean().reset_index()
+
+@st.cache_data(show_spinner=False)
+def site_hour_averages(filter_key, _df_filtered: pd.DataFrame, site_col: str, metrics: tuple) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Calcula los promedios por hora y por site con un único groupby por (site, hora)
+    
+    Se agregan sumas y conteos por par (site, hora) y de ellos se obtienen los
+    promedios exactos de cada marginal, sin volver a recorrer el DataFrame. Se
+    cachea por la selección de filtros, así los widgets no relacionados no lo
+    recalculan.
+    
+    Args:
+        filter_key: Archivo y filtros que determinan _df_filtered (key de caché)
+        _df_filtered: DataFrame filtrado con columna hour (no se hashea)
+        site_col: Columna de sites
+        metrics: Métricas a promediar
+        
+    Returns:
+        Tuple: (promedios por hora, promedios por site)
+    """
+    grouped = _df_filtered.groupby([site_col, "hour"], observed=True, sort=False, dropna=False)[list(metrics)]
+    sums = grouped.sum()
+    counts = grouped.count()
+    
+    # Las filas sin hora cuentan para el promedio por site, no para el horario
+    hourly_data = (
+        sums.groupby(level="hour", sort=False).sum() / counts.groupby(level="hour", sort=False).sum()
+    ).reset_index()
+    site_averages = (
+        sums.groupby(level=site_col, observed=True).sum() / counts.groupby(level=site_col, observed=True).sum()
+    ).reset_index()
+    
+    return hourly_data, site_averages
+
+def _write_csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Exporta un DataFrame a CSV con el escritor de pyarrow
+    
+    Args:
+        df: DataFrame a exportar
+        
+    Returns:
+        Contenido del archivo CSV
+    """
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        
+        # Las columnas category llegan como diccionario: se escriben como sus valores
+        for i, field in enumerate(table.schema):
+            if pa.types.is_dictionary(field.type):
+                table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+        
+        buffer = BytesIO()
+        pacsv.write_csv(table, buffer)
+        return buffer.getvalue()
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        # Columnas object con tipos mezclados: se usa el escritor de pandas
+        return df.to_csv(index=False).encode("utf-8")
+
+@st.cache_data(show_spinner=False)
+def dataframe_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Exporta un DataFrame a CSV, cacheado por contenido
+    
+    Args:
+        df: DataFrame a exportar
+        
+    Returns:
+        Contenido del archivo CSV
+    """
+    return _write_csv_bytes(df)
+
+@st.cache_data(show_spinner=False)
+def keyed_csv_bytes(cache_key, _df: pd.DataFrame) -> bytes:
+    """
+    Exporta un DataFrame a CSV, cacheado por una key explícita en lugar del contenido
+    
+    Evita hashear el DataFrame completo en cada rerun cuando una key pequeña
+    (archivo y selección) ya lo determina.
+    
+    Args:
+        cache_key: Key de caché que identifica el contenido de _df
+        _df: DataFrame a exportar (no se hashea)
+        
+    Returns:
+        Contenido del archivo CSV
+    """
+    return _write_csv_bytes(_df)
+
+# Filas convertidas a la vez al exportar a Excel
+EXCEL_EXPORT_CHUNK_ROWS = 10_000
+
+def dataframe_to_excel_bytes(df: pd.DataFrame, sheet_name: str) -> bytes:
+    """
+    Exporta un DataFrame a Excel (.xlsx) con xlsxwriter en modo constant_memory
+    
+    Cada fila se vuelca al archivo temporal de la hoja en cuanto se escribe y los
+    valores se convierten por bloques de EXCEL_EXPORT_CHUNK_ROWS filas, así la
+    memoria adicional no crece con el número de filas.
+    
+    Args:
+        df: DataFrame a exportar
+        sheet_name: Nombre de la hoja
+        
+    Returns:
+        Contenido del archivo .xlsx
+    """
+    buffer = BytesIO()
+    # constant_memory requiere escribir fila a fila en orden (in_memory lo desactivaría)
+    workbook = xlsxwriter.Workbook(buffer, {
+        'constant_memory': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+    })
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(col) for col in df.columns])
+    
+    # xlsxwriter no acepta NaN/NaT/NA: se escriben como celdas vacías. La conversión a
+    # object se hace por bloques de filas para no duplicar todo el DataFrame a la vez
+    for start in range(0, len(df), EXCEL_EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXCEL_EXPORT_CHUNK_ROWS]
+        values = chunk.astype(object).where(chunk.notna(), None).to_numpy()
+        for offset in range(values.shape[0]):
+            worksheet.write_row(start + offset + 1, 0, values[offset])
+    
+    workbook.close()
+    return buffer.getvalue()
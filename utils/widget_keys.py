@@ -1,13 +1,140 @@
 """
-Generador de keys únicas para widgets de Streamlit
-Evita el error StreamlitDuplicateElementId
+Generador de keys estables para widgets de Streamlit
+
+Cada (widget_type, description) de un módulo recibe siempre la misma key, en todos
+los reruns. Para evitar StreamlitDuplicateElementId, dos widgets del mismo tipo en un
+módulo deben usar descripciones distintas (sin descripción solo puede haber uno).
 """
 
+import sys
+from functools import partialmethod
+from itertools import count
+
+# Tablas de traducción para limpiar nombres y descripciones en una sola pasada
+_MOD_TRANS = str.maketrans({" ": "_", "ñ": "n"})
+_DESC_TRANS = str.maketrans({" ": "_", ":": "", "ñ": "n", "é": "e", "ó": "o"})
+
+# Descripciones ya limpiadas, compartidas entre generadores y tipos de widget
+_CLEAN_CACHE = {}
+
+
+def _clean(description: str) -> str:
+    """
+    Limpia una descripción para usarla en una key (memoizado por descripción)
+    
+    Args:
+        description: Descripción del widget
+        
+    Returns:
+        Descripción en minúsculas, sin espacios, dos puntos ni tildes
+    """
+    cleaned = _CLEAN_CACHE.get(description)
+    if cleaned is None:
+        cleaned = description.lower().translate(_DESC_TRANS)
+        _CLEAN_CACHE[description] = cleaned
+    return cleaned
+
+
+# Estado de keys por módulo (por nombre original y normalizado):
+# {"mod": nombre normalizado, "keys": {(widget_type, description): key}, "used": keys emitidas}
+_STATE = {}
+
+
+def _module_state(module_name: str) -> dict:
+    """
+    Obtiene o crea el estado de keys de un módulo
+    
+    Args:
+        module_name: Nombre del módulo, normalizado o no
+        
+    Returns:
+        Dict de estado compartido por todos los accesos al módulo
+    """
+    state = _STATE.get(module_name)
+    if state is None:
+        cleaned_name = module_name.lower().translate(_MOD_TRANS)
+        state = _STATE.get(cleaned_name)
+        if state is None:
+            state = {"mod": cleaned_name, "keys": {}, "used": set()}
+            _STATE[cleaned_name] = state
+        _STATE[module_name] = state
+    return state
+
+
+def _state_key(state: dict, widget_type: str, description: str) -> str:
+    """
+    Genera (o recupera) la key de un widget a partir del estado de su módulo
+    
+    Args:
+        state: Estado del módulo (ver _module_state)
+        widget_type: Tipo de widget (checkbox, selectbox, slider, etc.)
+        description: Descripción opcional del widget
+        
+    Returns:
+        Key del widget, la misma para los mismos (widget_type, description)
+    """
+    # Keys ya generadas por (widget_type, description): en cada rerun de Streamlit
+    # el mismo widget recibe la misma key
+    keys = state["keys"]
+    cache_key = (widget_type, description)
+    key = keys.get(cache_key)
+    if key is not None:
+        return key
+    
+    module_name = state["mod"]
+    
+    # Limpiar descripción para usar en la key
+    clean_description = _clean(description) if description else ""
+    
+    # (widget_type, description) ya identifica al widget: no hace falta sufijo numérico
+    if clean_description:
+        key = "_".join((module_name, widget_type, clean_description))
+    else:
+        key = "_".join((module_name, widget_type))
+    
+    # Solo si dos argumentos distintos limpian a la misma key se agrega un sufijo
+    used = state["used"]
+    if key in used:
+        base = key
+        for index in count(2):
+            key = f"{base}_{index}"
+            if key not in used:
+                break
+    
+    key = sys.intern(key)
+    used.add(key)
+    keys[cache_key] = key
+    return key
+
+
+def widget_key(module_name: str, widget_type: str, description: str = "") -> str:
+    """
+    Genera la key de un widget sin pasar por WidgetKeyGenerator
+    
+    Args:
+        module_name: Nombre del módulo (averias, desempeño, etc.)
+        widget_type: Tipo de widget (checkbox, selectbox, slider, etc.)
+        description: Descripción opcional del widget
+        
+    Returns:
+        Key del widget, estable por (widget_type, description); la misma que daría
+        el generador del módulo
+    """
+    state = _STATE.get(module_name)
+    if state is None:
+        state = _module_state(module_name)
+    return _state_key(state, widget_type, description)
+
+
 class WidgetKeyGenerator:
     """
-    Generador centralizado de keys únicas para widgets de Streamlit
+    Generador centralizado de keys para widgets de Streamlit
+    
+    Envoltorio de widget_key: las instancias de un mismo módulo comparten su estado.
     """
     
+    __slots__ = ("module_name", "_state")
+    
     def __init__(self, module_name: str):
         """
         Inicializa el generador con el nombre del módulo
@@ -15,76 +142,95 @@ class WidgetKeyGenerator:
         Args:
             module_name: Nombre del módulo (averias, desempeño, etc.)
         """
-        self.module_name = module_name.lower().replace(" ", "_").replace("ñ", "n")
-        self.counter = 0
+        self._state = _module_state(module_name)
+        self.module_name = self._state["mod"]
+    
+    @classmethod
+    def _preclean(cls, cleaned_name: str) -> "WidgetKeyGenerator":
+        """
+        Crea un generador con un nombre de módulo ya normalizado (sin limpiarlo otra vez)
+        
+        Args:
+            cleaned_name: Nombre del módulo en minúsculas, sin espacios ni ñ
+            
+        Returns:
+            Generador de keys para el módulo
+        """
+        generator = cls.__new__(cls)
+        # _module_state encuentra el nombre ya normalizado sin volver a limpiarlo
+        generator._state = _module_state(cleaned_name)
+        generator.module_name = cleaned_name
+        return generator
     
     def get_key(self, widget_type: str, description: str = "") -> str:
         """
-        Genera una key única para un widget
+        Genera la key de un widget
         
         Args:
             widget_type: Tipo de widget (checkbox, selectbox, slider, etc.)
-            description: Descripción opcional del widget
+            description: Descripción del widget; debe distinguirlo de los demás
+                widgets del mismo tipo en el módulo
             
         Returns:
-            Key única para el widget
+            Key del widget, la misma para los mismos (widget_type, description)
         """
-        self.counter += 1
-        
-        # Limpiar descripción para usar en la key
-        clean_description = description.lower().replace(" ", "_").replace(":", "").replace("ñ", "n").replace("é", "e").replace("ó", "o")
-        
-        if clean_description:
-            return f"{self.module_name}_{widget_type}_{clean_description}_{self.counter}"
-        else:
-            return f"{self.module_name}_{widget_type}_{self.counter}"
-    
-    def checkbox_key(self, description: str = "") -> str:
-        """Genera key para checkbox"""
-        return self.get_key("checkbox", description)
-    
-    def selectbox_key(self, description: str = "") -> str:
-        """Genera key para selectbox"""
-        return self.get_key("selectbox", description)
-    
-    def multiselect_key(self, description: str = "") -> str:
-        """Genera key para multiselect"""
-        return self.get_key("multiselect", description)
-    
-    def slider_key(self, description: str = "") -> str:
-        """Genera key para slider"""
-        return self.get_key("slider", description)
-    
-    def radio_key(self, description: str = "") -> str:
-        """Genera key para radio"""
-        return self.get_key("radio", description)
-    
-    def text_input_key(self, description: str = "") -> str:
-        """Genera key para text_input"""
-        return self.get_key("text_input", description)
-    
-    def date_input_key(self, description: str = "") -> str:
-        """Genera key para date_input"""
-        return self.get_key("date_input", description)
+        return _state_key(self._state, widget_type, description)
+
+
+# Atajos de los tipos de widget habituales (checkbox_key, selectbox_key, etc.),
+# definidos al crear la clase; otros tipos usan get_key directamente
+WIDGET_TYPES = (
+    "checkbox", "selectbox", "multiselect", "slider", "radio",
+    "text_input", "date_input", "button", "download_button"
+)
+for _widget_type in WIDGET_TYPES:
+    setattr(WidgetKeyGenerator, f"{_widget_type}_key", partialmethod(WidgetKeyGenerator.get_key, _widget_type))
+del _widget_type
+
+
+# Generadores pre-configurados para cada módulo (nombres ya normalizados): AVERIAS_KEYS,
+# DESEMPENO_KEYS, etc. se crean en el primer acceso mediante __getattr__ del módulo
+_LAZY_GENERATORS = {
+    "AVERIAS_KEYS": "averias",
+    "DESEMPENO_KEYS": "desempeno",
+    "CONFIGURATION_KEYS": "configuration",
+    "PROVISION_KEYS": "provision",
+    "DISPONIBILIDAD_KEYS": "disponibilidad",
+    "CALIDAD_KEYS": "calidad",
+    "PROYECTOS_KEYS": "proyectos",
+    "APP_KEYS": "app"
+}
+
+# API pública (los generadores perezosos se incluyen para que `import *` los cree)
+__all__ = ["WidgetKeyGenerator", "WIDGET_TYPES", "widget_key", "get_module_keys", *_LAZY_GENERATORS]
+
+
+def __getattr__(name: str) -> WidgetKeyGenerator:
+    """
+    Crea bajo demanda los generadores pre-configurados (PEP 562)
     
-    def button_key(self, description: str = "") -> str:
-        """Genera key para button"""
-        return self.get_key("button", description)
+    Args:
+        name: Nombre de la variable del módulo, p. ej. AVERIAS_KEYS
+        
+    Returns:
+        Generador de keys, guardado como variable global para los siguientes accesos
+    """
+    module_name = _LAZY_GENERATORS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
     
-    def download_button_key(self, description: str = "") -> str:
-        """Genera key para download_button"""
-        return self.get_key("download_button", description)
+    generator = WidgetKeyGenerator._preclean(module_name)
+    globals()[name] = generator
+    return generator
+
 
+# Variable global de cada módulo pre-configurado (inversa de _LAZY_GENERATORS, más
+# el alias con ñ de desempeño)
+_MODULE_GLOBALS = {module_name: name for name, module_name in _LAZY_GENERATORS.items()}
+_MODULE_GLOBALS["desempeño"] = "DESEMPENO_KEYS"
 
-# Generadores pre-configurados para cada módulo
-AVERIAS_KEYS = WidgetKeyGenerator("averias")
-DESEMPENO_KEYS = WidgetKeyGenerator("desempeno")
-CONFIGURATION_KEYS = WidgetKeyGenerator("configuration")
-PROVISION_KEYS = WidgetKeyGenerator("provision")
-DISPONIBILIDAD_KEYS = WidgetKeyGenerator("disponibilidad")
-CALIDAD_KEYS = WidgetKeyGenerator("calidad")
-PROYECTOS_KEYS = WidgetKeyGenerator("proyectos")
-APP_KEYS = WidgetKeyGenerator("app")
+# Generadores ya resueltos por nombre de módulo (incluye los creados bajo demanda)
+_MODULE_GENERATORS = {}
 
 
 def get_module_keys(module_name: str) -> WidgetKeyGenerator:
@@ -97,16 +243,18 @@ def get_module_keys(module_name: str) -> WidgetKeyGenerator:
     Returns:
         Generador de keys para el módulo
     """
-    module_generators = {
-        "averias": AVERIAS_KEYS,
-        "desempeno": DESEMPENO_KEYS,
-        "desempeño": DESEMPENO_KEYS,
-        "configuration": CONFIGURATION_KEYS,
-        "provision": PROVISION_KEYS,
-        "disponibilidad": DISPONIBILIDAD_KEYS,
-        "calidad": CALIDAD_KEYS,
-        "proyectos": PROYECTOS_KEYS,
-        "app": APP_KEYS
-    }
-    
-    return module_generators.get(module_name.lower(), WidgetKeyGenerator(module_name))
\ No newline at end of file
+    name = module_name.lower()
+    generator = _MODULE_GENERATORS.get(name)
+    if generator is not None:
+        return generator
+    
+    global_name = _MODULE_GLOBALS.get(name)
+    if global_name is not None:
+        generator = globals().get(global_name)
+        if generator is None:
+            generator = __getattr__(global_name)
+    else:
+        # Módulo no pre-configurado: se crea una vez y se reutiliza en las siguientes llamadas
+        generator = WidgetKeyGenerator(module_name)
+    
+    return _MODULE_GENERATORS.setdefault(name, generator)